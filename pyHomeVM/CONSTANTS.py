@@ -4,6 +4,7 @@ from datetime import datetime
 SCRIPT_ROOT_DIR = os.path.join(os.getcwd(), 'pyHomeVM')
 TODO_FILE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'todo.sh')
 STRUCTURE_FILE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'structure.json')
+STRUCTURE_STORE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'structure.jsonl')
 CHAPTERS_FILE_NAME = 'chapters.txt'
 TODAY = datetime.now().strftime("%Y%m%d")
 LOG_FILE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'logs', 'log_{}.txt'.format(TODAY))
@@ -11,12 +12,22 @@ HTML_HEADER_PATH = os.path.join(SCRIPT_ROOT_DIR, 'templates', 'custom', 'header.
 HTML_FOOTER_PATH = os.path.join(SCRIPT_ROOT_DIR, 'templates', 'custom', 'footer.html')
 HTML_BODY_PATH = os.path.join(SCRIPT_ROOT_DIR, 'templates', 'body.html')
 VIDEO_DB_PATH = os.path.join(SCRIPT_ROOT_DIR, 'video.db')
+VIDEO_STORE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'videos.sqlite')
+FILE_ID_CACHE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'file_ids.json')
+PROBE_CACHE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'probes.db')
+VERDICT_CACHE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'verdicts.db')
+CONVERSION_CACHE_DIR = os.path.join(SCRIPT_ROOT_DIR, 'conversions')
+PROGRESS_FILE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'progress.json')
+JOB_QUEUE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'jobs.json')
+FILE_ID_VERSION_PATH = os.path.join(SCRIPT_ROOT_DIR, 'file_id_version')
+FILE_ID_VERSION = 2
 LOGO_FILE_PATH = os.path.join(SCRIPT_ROOT_DIR, 'templates', 'media', 'logo.png')
 
 CONSTANTS = {
     'script_root_dir': SCRIPT_ROOT_DIR,
     'todo_file_path': TODO_FILE_PATH,
     'structure_file_path': STRUCTURE_FILE_PATH,
+    'structure_store_path': STRUCTURE_STORE_PATH,
     'chapters_file_name': CHAPTERS_FILE_NAME,
     'TODAY': TODAY,
     'log_file_path': LOG_FILE_PATH,
@@ -24,4 +35,13 @@ CONSTANTS = {
     'html_footer_path': HTML_FOOTER_PATH,
     'html_body_path': HTML_BODY_PATH,
     'video_db_path': VIDEO_DB_PATH,
+    'video_store_path': VIDEO_STORE_PATH,
+    'file_id_cache_path': FILE_ID_CACHE_PATH,
+    'probe_cache_path': PROBE_CACHE_PATH,
+    'verdict_cache_path': VERDICT_CACHE_PATH,
+    'conversion_cache_dir': CONVERSION_CACHE_DIR,
+    'progress_file_path': PROGRESS_FILE_PATH,
+    'job_queue_path': JOB_QUEUE_PATH,
+    'file_id_version_path': FILE_ID_VERSION_PATH,
+    'file_id_version': FILE_ID_VERSION,
     'logo_file_path': LOGO_FILE_PATH}
@@ -1,4 +1,7 @@
-__all__ = ["notifications", "settings", "classes", "CONSTANTS", "core"]
+__all__ = ["notifications", "settings", "classes", "CONSTANTS", "core", "caches",
+           "parallel", "library", "migrations", "watch", "scheduler", "segments",
+           "progress", "jobs", "videostore", "structurestore",
+           "structurediff", "transfer"]
 # from settings.settings import *
 # from core import *
 # from CONSTANTS import CONSTANTS
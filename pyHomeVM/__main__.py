@@ -3,17 +3,23 @@ import sys
 import os
 import logging
 import argparse
-import traceback
-import shelve
 from datetime import datetime
 from CONSTANTS import CONSTANTS
 from settings.settings import load_config, load_core, load_remote, load_email
-from settings.settings import load_html, load_sms
-from core import read_structure, readStructureFromFile, updateStructure
+from settings.settings import load_html, load_sms, load_resources
+from core import read_structure, updateStructure
 from core import clean_video_db, syncDirTree, transferLongVersions
-from core import executeToDoFile, build_html_report, umount
+from core import build_html_report, umount
 from core import check_and_correct_videos_errors, clean_remote
 from core import get_new_file_ids_from_structure, mount, check_mkv_videos
+from core import get_ffmpeg_version
+from caches import load_caches, close_caches
+from commands import set_resource_profiles
+from jobs import get_queue
+from library import scan_library
+from migrations import migrate_file_ids, migrate_todo_file, migrate_video_db
+from migrations import migrate_structure_file
+from watch import watch_library
 from notifications import send_sms_notification, send_mail_report, send_mail_log
 
 
@@ -37,6 +43,12 @@ def get_args():
     parser.add_argument('-b', '--backup',
                         help='Enables backup of first videos',
                         action='store_true')
+    parser.add_argument('-w', '--watch',
+                        help='Keeps running and processes folders as they change',
+                        action='store_true')
+    parser.add_argument('--recheck',
+                        help='Checks the integrity of videos already verified clean',
+                        action='store_true')
     parser.add_argument('-stats',
                         help='Gets you statistics about your videos',
                         action='store_true')
@@ -72,6 +84,8 @@ def main(argv=None):
         sys.exit()
     file(pidfile, 'w').write(pid)
     (ffmpeg, local) = load_core(config)  # load core configs
+    set_resource_profiles(load_resources(config))
+    local['ffmpeg_version'] = get_ffmpeg_version(local)
     remote = load_remote(config)
     html = load_html(config)
     sms = load_sms(config)
@@ -84,33 +98,37 @@ def main(argv=None):
         remote = load_remote(config)
     if(args.sms):
         sms = load_sms(config)
-    video_db = shelve.open(CONSTANTS['video_db_path'], writeback=True)
-    try:
-        if not os.path.exists(CONSTANTS['structure_file_path']):
-            raise Exception("Directory structure definition file not found.")
-        past_structure = readStructureFromFile(CONSTANTS)
-    except Exception:
-        logger.info(traceback.format_exc())
-        logger.info('{} not found'.format(CONSTANTS['structure_file_path']))
-        past_structure = {}  # Start as new
-    new_structure = read_structure(local)
+    video_db = migrate_video_db(CONSTANTS)
+    caches = load_caches(CONSTANTS, local)
+    store = migrate_structure_file(CONSTANTS)
+    migrate_file_ids(video_db, local, caches, CONSTANTS, store)
+    migrate_todo_file(CONSTANTS)
+    get_queue().report_exhausted()
+    past_structure = store.read()  # Empty if new
+    snapshot = scan_library(local)
+    new_structure = read_structure(local, caches, snapshot)
     video_ids = get_new_file_ids_from_structure(new_structure, video_db)
-    check_and_correct_videos_errors(video_ids, video_db, local, ffmpeg)
+    if(check_and_correct_videos_errors(
+            video_ids, video_db, local, ffmpeg, caches, args.recheck)):
+        snapshot = scan_library(local)  # Files were moved or re-encoded
+        new_structure = read_structure(local, caches, snapshot)
     logger.info('Checked for errors and corrupted')
     html_data = updateStructure(
         past_structure,
-        read_structure(local),
+        new_structure,
         local,
         ffmpeg,
         remote,
-        video_db)
+        video_db,
+        caches,
+        store=store)
+    if(any(html_data.values())):
+        snapshot = scan_library(local)  # Long versions were rebuilt
     sms_sent_file = os.path.join(CONSTANTS['script_root_dir'], 'sms_sent')
     if(mount(remote)):
         logger.info('Mount succesfull')
         syncDirTree(local, remote)
-        transferLongVersions(local, remote, video_db)
-        if(os.path.isfile(CONSTANTS['todo_file_path'])):
-            executeToDoFile(CONSTANTS['todo_file_path'], local, CONSTANTS)
+        transferLongVersions(local, remote, video_db, snapshot)
         if(os.path.exists(sms_sent_file)):
             os.remove(sms_sent_file)
             logger.info('sms_sent file has been deleted')
@@ -136,10 +154,16 @@ def main(argv=None):
     if(args.log):
         send_mail_log(CONSTANTS['log_file_path'], email, html)
         logger.info('log file sent')
+    if(args.watch):
+        watch_library(
+            store.read(), local, ffmpeg, remote, video_db, caches, store)
+        snapshot = scan_library(local)
     clean_video_db(video_db)
-    check_mkv_videos(local, video_db)
+    check_mkv_videos(local, video_db, caches, snapshot)
     logger.info('DB cleaned')
     video_db.close()
+    store.close()
+    close_caches(caches, prune=True)
     logger.info('Script ran in {}'.format(datetime.now() - start_time))
     os.unlink(pidfile)
 if __name__ == "__main__":
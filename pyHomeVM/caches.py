@@ -0,0 +1,381 @@
+# coding=utf-8
+"""Caches.
+
+Persistent caches that allow to skip expensive work
+(hashing, probing...) on files that did not change between runs
+"""
+import os
+import json
+import time
+import shelve
+import shutil
+import logging
+import threading
+import traceback
+from CONSTANTS import CONSTANTS
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+def to_unicode(file_path):
+    """Function that makes sure a path is unicode so it can be used as a key.
+
+    Input: file_path as string
+    Output: file_path as unicode
+    """
+    if(isinstance(file_path, bytes)):
+        return(file_path.decode('utf-8'))
+    return(file_path)
+
+
+def stat_signature(file_path, stat=None):
+    """Function that returns the signature of a file on disk.
+
+    Input:  - file_path as string
+            - stat as os.stat result (optional, avoids a second stat call)
+    Output: [size, mtime in ns, inode] as list
+    """
+    if(stat is None):
+        stat = os.stat(file_path)
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if(mtime_ns is None):  # python2 has no st_mtime_ns
+        mtime_ns = int(stat.st_mtime * 1000000000)
+    return([stat.st_size, mtime_ns, stat.st_ino])
+
+
+def write_json_atomic(data, file_path):
+    """Function that writes json to a temporary file and renames it.
+
+    A crash while writing never leaves a truncated file behind
+    Input: data as dict, file_path as string
+    Output: None
+    """
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as outfile:
+        json.dump(data, outfile)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.rename(tmp_path, file_path)
+
+
+class FileIdCache(object):
+    """File ID cache.
+
+    Class that remembers the file ID of every video keyed on
+    (path, size, mtime, inode) so that unchanged files are not hashed again
+    """
+
+    def __init__(self, file_path):
+        """__init__."""
+        self.file_path = file_path
+        self.entries = {}
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Load the cache from disk, starting empty if it is unreadable."""
+        if(not os.path.exists(self.file_path)):
+            return
+        try:
+            with open(self.file_path, 'r') as f:
+                data = json.load(f)
+        except Exception:
+            logger.info(traceback.format_exc())
+            logger.info('File ID cache unreadable, starting empty')
+            return
+        if(data.get('version') != CONSTANTS['file_id_version']):
+            logger.info('File ID cache built with another ID version, starting empty')
+            return
+        self.entries = data['entries']
+
+    def get(self, file_path, stat=None):
+        """Return the cached file ID or None if the file changed."""
+        key = to_unicode(file_path)
+        signature = stat_signature(file_path, stat)
+        with self.lock:
+            self.seen.add(key)
+            entry = self.entries.get(key)
+            if(entry is not None and entry[:3] == signature):
+                self.hits += 1
+                return(entry[3])
+            self.misses += 1
+        return(None)
+
+    def set(self, file_path, file_id, stat=None):
+        """Store the file ID of a file with its current signature."""
+        key = to_unicode(file_path)
+        signature = stat_signature(file_path, stat)
+        with self.lock:
+            self.seen.add(key)
+            self.entries[key] = signature + [file_id]
+
+    def save(self, prune=False):
+        """Write the cache to disk.
+
+        When prune is True, entries of files that were not seen
+        during this run (deleted or moved away) are evicted
+        """
+        with self.lock:
+            if(prune):
+                for key in set(self.entries) - self.seen:
+                    del(self.entries[key])
+            write_json_atomic(
+                {'version': CONSTANTS['file_id_version'], 'entries': self.entries},
+                self.file_path)
+        logger.info('File ID cache saved: {} hits, {} misses, {} entries'.format(
+            self.hits, self.misses, len(self.entries)))
+
+
+class ShelveCache(object):
+    """Shelve cache.
+
+    Class that stores one entry per file ID in a shelve, along with the
+    path, size and mtime the file had, so entries of changed files are
+    ignored and the ones of files that disappeared can be pruned
+    """
+
+    def __init__(self, file_path, name):
+        """__init__."""
+        self.db = shelve.open(file_path)
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_entry(self, file_id, file_path):
+        """Return the entry of a file or None if the file changed."""
+        signature = stat_signature(file_path)[:2]
+        with self.lock:
+            entry = self.db.get(str(file_id))
+            if(entry is not None and entry['signature'] == signature):
+                self.hits += 1
+                return(entry)
+            self.misses += 1
+        return(None)
+
+    def set_entry(self, file_id, file_path, entry):
+        """Store the entry of a file with its current signature."""
+        entry['path'] = to_unicode(file_path)
+        entry['signature'] = stat_signature(file_path)[:2]
+        with self.lock:
+            self.db[str(file_id)] = entry
+        return(entry)
+
+    def prune(self):
+        """Evict the entries of files that disappeared or changed."""
+        with self.lock:
+            for file_id in list(self.db.keys()):
+                entry = self.db[file_id]
+                try:
+                    current = stat_signature(entry['path'].encode('utf-8'))[:2]
+                except OSError:
+                    current = None
+                if(current != entry['signature']):
+                    del(self.db[file_id])
+
+    def save(self, prune=False):
+        """Write the cache to disk."""
+        if(prune):
+            self.prune()
+        with self.lock:
+            self.db.sync()
+        logger.info('{} cache saved: {} hits, {} misses'.format(
+            self.name, self.hits, self.misses))
+
+    def close(self):
+        """Close the underlying shelve."""
+        with self.lock:
+            self.db.close()
+
+
+class ProbeCache(ShelveCache):
+    """Probe cache.
+
+    Class that stores the parsed ffprobe output of every video
+    """
+
+    def __init__(self, file_path):
+        """__init__."""
+        ShelveCache.__init__(self, file_path, 'Probe')
+
+    def get(self, file_id, file_path):
+        """Return the cached probe of a file or None if it changed.
+
+        Output: dict with 'data' (parsed ffprobe json) and 'invalid' (Bool)
+        """
+        return(self.get_entry(file_id, file_path))
+
+    def set(self, file_id, file_path, data, invalid):
+        """Store the probe of a file."""
+        return(self.set_entry(file_id, file_path, {'data': data, 'invalid': invalid}))
+
+
+class VerdictCache(ShelveCache):
+    """Verdict cache.
+
+    Class that stores the integrity verdict of every checked video with
+    the ffmpeg version and the check tier that gave it
+    """
+
+    def __init__(self, file_path):
+        """__init__."""
+        ShelveCache.__init__(self, file_path, 'Verdict')
+
+    def get(self, file_id, file_path, ffmpeg_version):
+        """Return the verdict of a file, None if unknown or given by another ffmpeg.
+
+        Output: dict with 'state', 'ffmpeg_version', 'tier' and 'timestamp'
+        """
+        entry = self.get_entry(file_id, file_path)
+        if(entry is None or entry['ffmpeg_version'] != ffmpeg_version):
+            return(None)
+        return(entry)
+
+    def set(self, file_id, file_path, state, ffmpeg_version, tier):
+        """Store the verdict of a file."""
+        return(self.set_entry(file_id, file_path, {
+            'state': state,
+            'ffmpeg_version': ffmpeg_version,
+            'tier': tier,
+            'timestamp': time.time()}))
+
+
+class ConversionCache(object):
+    """Conversion cache.
+
+    Class that keeps converted (compatibility) videos in a folder, one
+    sub folder per conversion key, so a rebuild of a long version reuses
+    the conversions of the clips that did not change. When the cache
+    grows over max_size bytes, the least recently used conversions are
+    deleted, except the ones used during this run.
+    """
+
+    def __init__(self, folder_path, max_size):
+        """__init__."""
+        self.folder_path = folder_path
+        self.index_path = os.path.join(folder_path, 'index.json')
+        self.max_size = max_size
+        self.entries = {}
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if(not os.path.exists(folder_path)):
+            os.makedirs(folder_path)
+        self.load()
+
+    def load(self):
+        """Load the index, forgetting conversions deleted from disk."""
+        if(not os.path.exists(self.index_path)):
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                entries = json.load(f)
+        except Exception:
+            logger.info(traceback.format_exc())
+            logger.info('Conversion cache index unreadable, starting empty')
+            return
+        for key, entry in entries.items():
+            if(os.path.isfile(self.entry_path(key, entry))):
+                self.entries[key] = entry
+
+    def entry_path(self, key, entry):
+        """Return the path of a cached conversion."""
+        return(os.path.join(self.folder_path, key, entry['file_name'].encode('utf-8')))
+
+    def get(self, key):
+        """Return the path of a cached conversion or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if(entry is None or not os.path.isfile(self.entry_path(key, entry))):
+                self.misses += 1
+                return(None)
+            self.hits += 1
+            entry['last_used'] = time.time()
+            self.pinned.add(key)
+            return(self.entry_path(key, entry))
+
+    def put(self, key, file_path):
+        """Move a converted video into the cache and return its new path."""
+        entry_folder = os.path.join(self.folder_path, key)
+        if(not os.path.exists(entry_folder)):
+            os.makedirs(entry_folder)
+        file_name = os.path.basename(file_path)
+        cached_path = os.path.join(entry_folder, file_name)
+        shutil.move(file_path, cached_path)
+        with self.lock:
+            self.entries[key] = {
+                'file_name': to_unicode(file_name),
+                'size': os.path.getsize(cached_path),
+                'last_used': time.time()}
+            self.pinned.add(key)
+            self.evict()
+        return(cached_path)
+
+    def evict(self):
+        """Delete least recently used conversions until under max_size."""
+        total = sum(entry['size'] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda key: self.entries[key]['last_used']):
+            if(total <= self.max_size):
+                break
+            if(key in self.pinned):
+                continue
+            total -= self.entries[key]['size']
+            shutil.rmtree(os.path.join(self.folder_path, key), ignore_errors=True)
+            del(self.entries[key])
+            logger.info('Conversion {} evicted from cache'.format(key))
+
+    def save(self, prune=False):
+        """Write the index to disk."""
+        with self.lock:
+            write_json_atomic(self.entries, self.index_path)
+        logger.info('Conversion cache saved: {} hits, {} misses, {} entries'.format(
+            self.hits, self.misses, len(self.entries)))
+
+
+def load_caches(CONSTANTS, local):
+    """Function that opens every persistent cache.
+
+    Input: CONSTANTS as dict, local as local config dict
+    Output: caches as dict
+    """
+    caches = {}
+    caches['file_ids'] = FileIdCache(CONSTANTS['file_id_cache_path'])
+    caches['probes'] = ProbeCache(CONSTANTS['probe_cache_path'])
+    caches['verdicts'] = VerdictCache(CONSTANTS['verdict_cache_path'])
+    caches['conversions'] = ConversionCache(
+        local['conversion_cache_dir'],
+        local['conversion_cache_max_size'])
+    return(caches)
+
+
+def save_caches(caches, prune=False):
+    """Function that writes every persistent cache back to disk.
+
+    Input: caches as dict, prune as Bool (True after a full library scan)
+    Output: None
+    """
+    caches['file_ids'].save(prune=prune)
+    caches['probes'].save(prune=prune)
+    caches['verdicts'].save(prune=prune)
+    caches['conversions'].save(prune=prune)
+
+
+def close_caches(caches, prune=False):
+    """Function that saves and closes every persistent cache.
+
+    Input: caches as dict, prune as Bool (True after a full library scan)
+    Output: None
+    """
+    save_caches(caches, prune=prune)
+    caches['probes'].close()
+    caches['verdicts'].close()
@@ -7,6 +7,10 @@ import time
 import json
 import traceback
 from commands import executeCommand
+from parallel import run_in_pool
+from caches import to_unicode
+from segments import use_segments, encode_in_segments
+from progress import execute_with_progress
 
 
 logger = logging.getLogger(__name__)
@@ -20,9 +24,18 @@ logger.addHandler(handler)
 class Video(object):
     """Video class.
 
-    Class that creates instances of the videos managed
+    Class that creates instances of the videos managed.
+    Videos have no __dict__, they are pickled as a versioned record
+    (see to_record), videos pickled by older versions are still read.
     """
 
+    RECORD_VERSION = 1
+    FIELDS = (
+        'file_id', 'file_path', 'file_name', 'category', 'duration', 'offset',
+        'video_codec', 'audio_codec', 'composer', 'height', 'width',
+        'frame_rate', 'creation_time', 'video_type', 'source_ids')
+    __slots__ = FIELDS
+
     def __init__(self, file_id, file_path, category):
         """__ini__."""
         self.file_path = file_path
@@ -39,6 +52,32 @@ class Video(object):
         self.creation_time = None
         self.video_type = None
         self.category = category
+        self.source_ids = None  # Long versions only, file IDs of the clips merged
+
+    def to_record(self):
+        """Return the video as a tuple: the record version then FIELDS."""
+        return((self.RECORD_VERSION,) + tuple(
+            getattr(self, field) for field in self.FIELDS))
+
+    @classmethod
+    def from_record(cls, record):
+        """Build a video from a record (see to_record)."""
+        video = cls.__new__(cls)
+        video.__setstate__(record)
+        return(video)
+
+    def __getstate__(self):
+        return(self.to_record())
+
+    def __setstate__(self, state):
+        if(isinstance(state, dict)):  # Pickled with a __dict__ by an older version
+            values = dict((field, state.get(field)) for field in self.FIELDS)
+        elif(state[0] == 1):
+            values = dict(zip(self.FIELDS, state[1:]))
+        else:
+            raise ValueError('Unknown video record version {}'.format(state[0]))
+        for field, value in values.items():
+            setattr(self, field, value)
 
     def __str__(self):
         return('File name: {}\nDuration: {}\nComposer: {}'.format(
@@ -47,15 +86,15 @@ class Video(object):
             #self.video_duration,
             self.composer))
 
-    def populate_video_details(self, local):
-        command = (
-            "'{}' -v quiet -show_format "
-            "-show_streams -print_format json "
-            "-sexagesimal '{}'").format(
-            local['ffprobe_executable_path'],
-            self.file_path.encode('utf-8'))
-        stdout, err = executeCommand(command)
-        stdout = json.loads(stdout)
+    def probe(self, local, caches=None):
+        """Return the parsed ffprobe output of the video."""
+        return(probe_file(self.file_path, local, self.file_id, caches)['data'])
+
+    def populate_video_details(self, local, caches=None):
+        self.apply_probe(self.probe(local, caches))
+
+    def apply_probe(self, stdout):
+        """Fill in the video details from parsed ffprobe output."""
         streams = stdout.get('streams')
         for stream_num, stream in enumerate(streams):
             if(stdout['streams'][stream_num]['codec_type'] == 'video'):
@@ -97,46 +136,150 @@ class Video(object):
             creation_time = self.creation_time
         else:
             creation_time = time.strftime('%Y-%m-%d %H:%M:%S')
-        command = (
-            "'{}' -loglevel panic -y -i '{}' "
+        video_options = (
             "-rc_eq 'blurCplx^(1-qComp)' "
-            "-c:v {} -c:a {} -preset {} -crf {} "
-            "-metadata composer={} -metadata creation_time='{}' "
-            "-movflags +faststart -pix_fmt yuv420p "
-            "-profile:v high -level 3.1 '{}'").format(
-            local['ffmpeg_executable_path'],
-            self.file_path,
+            "-c:v {} -preset {} -crf {} -threads {} "
+            "-pix_fmt yuv420p -profile:v high -level 3.1").format(
             ffmpeg['vcodec'],
-            ffmpeg['acodec'],
             ffmpeg['preset'],
             ffmpeg['crf'],
-            composer,
-            creation_time,
-            output_file.decode('utf-8'))
-        executeCommand(command)
+            local['ffmpeg_threads'])
+        self.encode(
+            local,
+            output_file,
+            video_options,
+            '-c:a {}'.format(ffmpeg['acodec']),
+            "-metadata composer={} -metadata creation_time='{}' -movflags +faststart".format(
+                composer,
+                creation_time))
+
+    def remuxVideo(self, ffmpeg, local, output_file, encode_audio=False):
+        """Copy the streams into a new mp4 container, re-encoding only
+        the audio when encode_audio is True."""
+        if(encode_audio):
+            audio = '{} -threads {}'.format(ffmpeg['acodec'], local['transcode_threads'])
+        else:
+            audio = 'copy'
+        command = (
+            "'{}' -loglevel panic -y -i '{}' "
+            "-c:v copy -c:a {} "
+            "-movflags +faststart '{}'").format(
+            local['ffmpeg_executable_path'],
+            self.file_path.encode('utf-8'),
+            audio,
+            output_file.encode('utf-8'))
+        executeCommand(command, 'heavy')
+        return(output_file)
 
     def convertVideo(self, ffmpeg, local, formats, compatibility_folder_path):
         output_file = os.path.join(
             compatibility_folder_path,
             os.path.splitext(os.path.basename(self.file_path))[0] + '.mp4')
-        command = (
-            "'{}' -loglevel panic -y -i '{}' "
+        video_options = (
             "-rc_eq 'blurCplx^(1-qComp)' "
-            "-vf scale={}:{} -r {} -c:v {} -c:a {} -preset {} -crf {} "
-            "-metadata composer={} -metadata creation_time='{}' "
-            "-movflags +faststart -pix_fmt yuv420p "
-            "-profile:v high -level 3.1 '{}'").format(
-            local['ffmpeg_executable_path'],
-            self.file_path.encode('utf-8'),
+            "-vf scale={}:{} -r {} -c:v {} -preset {} -crf {} -threads {} "
+            "-pix_fmt yuv420p -profile:v high -level 3.1").format(
             formats['width'],
             formats['height'],
             formats['frame_rate'],
             ffmpeg['vcodec'],
-            ffmpeg['acodec'],
             ffmpeg['preset'],
             ffmpeg['crf'],
-            self.composer,
-            self.creation_time,
-            output_file.encode('utf-8'))
-        executeCommand(command)
+            local['transcode_threads'])
+        self.encode(
+            local,
+            output_file,
+            video_options,
+            '-c:a {}'.format(ffmpeg['acodec']),
+            "-metadata composer={} -metadata creation_time='{}' -movflags +faststart".format(
+                self.composer,
+                self.creation_time))
         return(output_file)
+
+    def encode(self, local, output_file, video_options, audio_options, output_options):
+        """Encode the video with the given ffmpeg options, in segments
+        running in parallel when the video is long enough (see segments)."""
+        duration = duration_to_seconds(self.duration)
+        if(use_segments(local, duration, video_options)):
+            if(encode_in_segments(local, self.file_path, output_file, duration,
+                                  self.audio_codec is not None,
+                                  video_options, audio_options, output_options)):
+                return
+            logger.info('Segmented encode failed for {}, encoding in one pass'.format(
+                to_unicode(self.file_path).encode('utf-8')))
+        command = "'{}' -loglevel panic -y -i '{}' {} {} {} '{}'".format(
+            local['ffmpeg_executable_path'],
+            to_unicode(self.file_path).encode('utf-8'),
+            video_options,
+            audio_options,
+            output_options,
+            to_unicode(output_file).encode('utf-8'))
+        execute_with_progress(command, to_unicode(output_file).encode('utf-8'), duration)
+
+
+def duration_to_seconds(duration):
+    """
+    Function that converts a sexagesimal duration (H:MM:SS.micro)
+    into seconds
+    Input: duration as string
+    Output: seconds as float, None if the duration is unknown
+    """
+    try:
+        hours, minutes, seconds = duration.split(':')
+        return(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+    except (AttributeError, ValueError):
+        return(None)
+
+
+def probe_file(file_path, local, file_id=None, caches=None):
+    """Probe a file.
+
+    Function that runs ffprobe on a file, or reads its result from the
+    probe cache when the file was already probed. The same result serves
+    the integrity check and the video details.
+    Input:  - file_path as string
+            - local as local config dict
+            - file_id as string (optional, needed to use the cache)
+            - caches as dict of caches (optional)
+    Output: dict with 'data' (parsed ffprobe json) and 'invalid' (Bool)
+    """
+    if(caches is not None and file_id is not None):
+        entry = caches['probes'].get(file_id, file_path)
+        if(entry is not None):
+            return(entry)
+    command = (
+        "'{}' -hide_banner -show_format "
+        "-show_streams -print_format json "
+        "-sexagesimal '{}'").format(
+        local['ffprobe_executable_path'],
+        file_path.encode('utf-8'))
+    stdout, err = executeCommand(command)
+    invalid = 'Invalid data found when processing input' in err
+    if(invalid):
+        data = None
+    else:
+        data = json.loads(stdout)
+    if(caches is not None and file_id is not None):
+        return(caches['probes'].set(file_id, file_path, data, invalid))
+    return({'data': data, 'invalid': invalid})
+
+
+def populate_videos_details(videos, local, caches=None):
+    """Probe a list of videos.
+
+    Function that runs populate_video_details on every video through a
+    pool of local['probe_workers'] ffprobe processes. A video that can
+    not be probed is logged and does not stop the others.
+    Input: videos as list of Video, local as local config dict
+    Output: list of the videos that could not be probed
+    """
+    def probe_video(video):
+        try:
+            video.populate_video_details(local, caches)
+            return(True)
+        except Exception:
+            logger.info(traceback.format_exc())
+            logger.info('Could not probe {}'.format(video.file_path.encode('utf-8')))
+            return(False)
+    probed = run_in_pool(probe_video, videos, local['probe_workers'])
+    return([video for video, ok in zip(videos, probed) if not ok])
@@ -1,4 +1,9 @@
+import os
+import re
+import time
+import signal
 import logging
+import threading
 import subprocess
 from CONSTANTS import CONSTANTS
 
@@ -9,21 +14,174 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+WINDOW_POLL = 60  # Seconds between two checks of the time windows
+THREADS_PATTERN = re.compile(r'-threads ([0-9]+)')
 
-def executeCommand(command):
+# Resource profiles, see set_resource_profiles. Heavy commands (encodes,
+# decodes, merges) can be restricted, light ones (probes, hashing) keep going
+profiles = {
+    'light': {'nice': 0, 'ionice_class': 0, 'ionice_level': 0,
+              'threads': 0, 'windows': [], 'outside_windows': 'wait'},
+    'heavy': {'nice': 0, 'ionice_class': 0, 'ionice_level': 0,
+              'threads': 0, 'windows': [], 'outside_windows': 'wait'}}
+
+
+def set_resource_profiles(resources):
     """
-    Function that executes a command to shell.
-    Allows to waitbetween each command
-    Input: command as string
+    Function that sets the resource profiles used by executeCommand
+    Input: resources as dict of profile name -> profile dict, with the
+           windows as string (see load_resources)
+    Ouptut: None
+    """
+    for name, profile in resources.items():
+        profile = dict(profile)
+        profile['windows'] = parse_windows(profile['windows'])
+        profiles[name] = profile
+        logger.info('Resource profile {}: {}'.format(name, profile))
+
+
+def parse_windows(windows):
+    """
+    Function that reads time of day windows ('01:00-07:00,22:30-23:59').
+    A window can go over midnight ('22:00-06:00').
+    Input: windows as string
+    Ouptut: list of (start, end) as minutes after midnight
+    """
+    parsed = []
+    for window in windows.split(','):
+        if(window.strip() == ''):
+            continue
+        start, end = window.strip().split('-')
+        parsed.append(tuple(
+            int(hours) * 60 + int(minutes)
+            for hours, minutes in (start.split(':'), end.split(':'))))
+    return(parsed)
+
+
+def in_windows(windows, now=None):
+    """
+    Function that tells if heavy work is allowed at a time of day.
+    Input: windows as list (see parse_windows), empty means always
+    Ouptut: Bool
+    """
+    if(len(windows) == 0):
+        return(True)
+    now = now or time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    for start, end in windows:
+        if(start <= end and start <= minute < end):
+            return(True)
+        if(start > end and (minute >= start or minute < end)):
+            return(True)
+    return(False)
+
+
+def wait_for_windows(profile):
+    """Function that sleeps until the time windows of a profile allow work."""
+    if(in_windows(profile['windows'])):
+        return
+    logger.info('Outside of the allowed time windows, waiting')
+    while(not in_windows(profile['windows'])):
+        time.sleep(WINDOW_POLL)
+
+
+def apply_profile(command, profile):
+    """
+    Function that adds the nice, ionice and threads limits of a profile to
+    a command. Commands are single programs (ffmpeg, mkvmerge...).
+    Input: command as string, profile as dict
+    Ouptut: command as string
+    """
+    if(profile['threads'] > 0):
+        command = THREADS_PATTERN.sub(
+            lambda match: '-threads {}'.format(
+                min(int(match.group(1)) or profile['threads'], profile['threads'])),
+            command)
+    if(profile['ionice_class'] > 0):
+        command = 'ionice -c {} -n {} {}'.format(
+            profile['ionice_class'], profile['ionice_level'], command)
+    if(profile['nice'] > 0):
+        command = 'nice -n {} {}'.format(profile['nice'], command)
+    return(command)
+
+
+def pause_outside_windows(proc, profile):
+    """
+    Function that stops a running command (SIGSTOP on its process group)
+    when the time windows of its profile close and continues it (SIGCONT)
+    when they open again. Runs in a thread until the command ends.
+    Input: proc as subprocess.Popen started in its own process group
     Ouptut: None
     """
+    paused = False
+    while(proc.poll() is None):
+        allowed = in_windows(profile['windows'])
+        try:
+            if(paused and allowed):
+                os.killpg(proc.pid, signal.SIGCONT)
+                logger.info('Time window open, command {} continued'.format(proc.pid))
+                paused = False
+            elif(not paused and not allowed):
+                os.killpg(proc.pid, signal.SIGSTOP)
+                logger.info('Time window closed, command {} paused'.format(proc.pid))
+                paused = True
+        except OSError:  # Ended meanwhile
+            return
+        time.sleep(WINDOW_POLL)
+
+
+def start_command(command, profile='light', stdout=subprocess.PIPE,
+                  stderr=subprocess.PIPE):
+    """
+    Function that starts a command with a resource profile: it waits for
+    the time windows of the profile, then runs it with its limits. A
+    command that can be paused runs in its own process group.
+    Input: command as string, profile as profile name
+    Ouptut: subprocess.Popen
+    """
+    profile = profiles[profile]
+    wait_for_windows(profile)
+    command = apply_profile(command, profile)
     logger.debug('Executing: {}'.format(command))
+    pausable = len(profile['windows']) != 0 and profile['outside_windows'] == 'pause'
     proc = subprocess.Popen(
         command,
         shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    stdout, err = proc.communicate()
+        stdout=stdout,
+        stderr=stderr,
+        preexec_fn=os.setpgrp if pausable else None)
+    if(pausable):
+        guard = threading.Thread(target=pause_outside_windows, args=(proc, profile))
+        guard.daemon = True
+        guard.start()
+    return(proc)
+
+
+def stop_command(proc):
+    """
+    Function that kills a command and its process group, used when the
+    program is interrupted while a command in its own group runs
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGCONT)
+        os.killpg(proc.pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+
+def executeCommand(command, profile='light'):
+    """
+    Function that executes a command to shell.
+    Allows to waitbetween each command
+    Input: command as string, profile as resource profile name
+    Ouptut: None
+    """
+    proc = start_command(command, profile)
+    try:
+        stdout, err = proc.communicate()
+    except BaseException:
+        stop_command(proc)
+        raise
     logger.info('STDOUT:{}'.format(stdout))
     logger.info('ERR:{}'.format(err))
     proc.wait()
@@ -11,17 +11,25 @@ import json
 import re
 import codecs
 import hashlib
+import mmap
+import _strptime  # Imported before threads use strptime (python 2 import race)
 from datetime import datetime
 from datetime import timedelta
 import subprocess
-import copy
 import logging
 import traceback
 import shutil
 from string import Template
 from CONSTANTS import CONSTANTS
-from classes import Video
+from classes import Video, populate_videos_details, probe_file, duration_to_seconds
 from commands import executeCommand
+from parallel import run_in_pool, run_as_completed
+from scheduler import get_scheduler
+from jobs import get_queue
+from transfer import transfer_file
+from caches import to_unicode
+from library import scan_library, scan_folders
+from structurediff import diff_structures, NEW, MOVED, MODIFIED, DELETED
 
 
 logger = logging.getLogger(__name__)
@@ -32,92 +40,113 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
-def create_file_id(file_path, block_size=256):
+def create_file_id(file_path, sample_size=65536):
     """Create a file ID.
 
-    Function that takes a file and returns the first 10 characters of a hash of
-    the first 10 block of bytes
-    Input: File
-    Output: Hash of 10 blocks of 128 bits of size as string
+    Function that takes a file and returns a hash of three samples of
+    sample_size bytes (head, middle and tail) read through mmap.
+    Small files are hashed whole. The ID is prefixed with the ID
+    version so that older IDs can be recognised and migrated.
+    Input: file_path as string, sample_size as int
+    Output: version + 16 hex characters of sha1 + file size as string
     """
     file_size = os.path.getsize(file_path)
-    start_index = int(file_size / 2)
-    with open(file_path, 'r') as f:
-        f.seek(start_index)
-        n = 1
-        md5 = hashlib.md5()
-        while True:
-            data = f.read(block_size)
-            n += 1
-            if (n == 10):
-                break
-            md5.update(data)
-    return("{}{}".format(md5.hexdigest()[0:9], str(file_size)))
-
-
-def create_folder_id(folder_path, local):
-    """Create a folder ID.
-
-    Function that takes a folder path and returns a unique ID to
-    identify a specific content of folder.
-    Input: folder_path as string
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        if(file_size <= 3 * sample_size):
+            sha1.update(f.read())
+        else:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                middle = (file_size - sample_size) // 2
+                for start in (0, middle, file_size - sample_size):
+                    sha1.update(data[start:start + sample_size])
+            finally:
+                data.close()
+    return("v{}{}{}".format(
+        CONSTANTS['file_id_version'],
+        sha1.hexdigest()[0:16],
+        str(file_size)))
+
+
+def get_file_id(file_path, caches=None, stat=None):
+    """Get a file ID.
+
+    Function that returns the file ID of a file, looking it up in the
+    file ID cache first and only hashing the file on a cache miss
+    Input:  - file_path as string
+            - caches as dict of caches (optional)
+            - stat as os.stat result (optional)
     Output: ID as string
     """
+    if(caches is None):
+        return(create_file_id(file_path))
+    id_cache = caches['file_ids']
+    if(stat is None):
+        stat = os.stat(file_path)
+    file_id = id_cache.get(file_path, stat)
+    if(file_id is None):
+        file_id = create_file_id(file_path)
+        id_cache.set(file_path, file_id, stat)
+    return(file_id)
+
+
+def build_folder_id(file_names, file_ids):
+    """Build a folder ID.
+
+    Function that concatenates the file IDs of a folder
+    (in file name order) into the folder ID
+    Input: file_names as sorted list, file_ids as list in the same order
+    Output: ID as string, video_list as dict
+    """
     folder_id = ''
     video_list = {}
-    for file_name in sorted(list_video_files(folder_path, local)):  # loop files
-        cur_path = os.path.join(folder_path, file_name)
-        file_id = create_file_id(cur_path)
+    for file_name, file_id in zip(file_names, file_ids):
         video_list[file_id] = file_name.decode('utf-8')
         folder_id += file_id
     return(folder_id, video_list)
 
 
-def list_video_files(folder_path, local):
-    """List video files.
-
-    Function that lists the video files found in a folder
-    Input: folder_path as string
-    Output: list of videos paths (as strings)
-    """
-    return [i
-            for i in os.listdir(folder_path)
-            if os.path.isfile(os.path.join(folder_path, i)) and
-            check_if_vid(os.path.join(folder_path, i), local)]
-
-
-def check_mkv_videos(local, video_db):
+def check_mkv_videos(local, video_db, caches=None, snapshot=None):
     """Verify mkv videos.
 
     Function that checks that all mkvs long videos have
     the same name than their folder
     """
-    root_dir = local['root_dir']
-    for i in os.walk(root_dir):
-        if(len(i[0].split('/')) - 2 == len(root_dir.split('/')) and  # 2 levels
-            re.match(r'^[0-9]{4}$', i[0].split('/')[-2]) and  # match year
-                len(i[2]) != 0):  # is not empty
-            for video in i[2]:
-                if(os.path.splitext(video)[1] == '.mkv'):
-                    file_path = os.path.join(i[0], video)
-                    vid_id = create_file_id(file_path)
-                    if(video_db[vid_id].file_path != file_path.decode('utf-8')):
-                        os.rename(
-                            file_path,
-                            os.path.join(
-                                os.path.dirname(file_path),
-                                os.path.dirname(file_path).split('/')[-1]) + '.mkv')
-                        video_db[vid_id].file_path = file_path
+    if(snapshot is None):
+        snapshot = scan_library(local)
+    for file_path, file_stat in snapshot.mkvs:
+        vid_id = get_file_id(file_path, caches, file_stat)
+        if(video_db[vid_id].file_path != file_path.decode('utf-8')):
+            os.rename(
+                file_path,
+                os.path.join(
+                    os.path.dirname(file_path),
+                    os.path.dirname(file_path).split('/')[-1]) + '.mkv')
+            video = video_db[vid_id]
+            video.file_path = file_path
+            video_db[vid_id] = video
 
 
 def write_structure(structure, file_path):
-    """Function that writes a dir structure to dir_tree.json file.
+    """Function that writes a dir structure to a structure.jsonl file.
 
+    One folder per line, sorted by path so that the folders of a year
+    follow each other. The file is written to a temporary file and
+    renamed, a crash never leaves a truncated structure behind.
     Input: structure as dict, file_path as string
     Output: None
     """
-    with open(file_path, 'w') as outfile:
-        json.dump(structure, outfile)
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as outfile:
+        for ID in sorted(structure, key=lambda ID: structure[ID]['path']):
+            outfile.write(json.dumps({
+                'id': ID,
+                'path': structure[ID]['path'],
+                'video_list': structure[ID]['video_list']}) + '\n')
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.rename(tmp_path, file_path)
 
 
 def convert_keys_to_string(dictionary):
@@ -128,20 +157,21 @@ def convert_keys_to_string(dictionary):
                 for k, v in dictionary.items())
 
 
-def readStructureFromFile(CONSTANTS):
-    """Function that reads a structure file from a json file.
+def iter_structure(file_path):
+    """Function that streams a structure.jsonl file.
 
-    Input: file_path as string dir_tree.json
-    Output: structure as dict
+    Only one line is decoded at a time, the file is never loaded whole.
+    Input: file_path as string
+    Output: generator of (ID, entry)
     """
-    with codecs.open(CONSTANTS['structure_file_path'], 'r', 'utf-8') as f:
-        try:
-            structure = json.load(f)
-        except Exception:
-            logger.info(traceback.format_exc())
-            return {}
-    converted_structure = convert_keys_to_string(structure)
-    return(converted_structure)
+    with codecs.open(file_path, 'r', 'utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            yield((str(record['id']), {
+                'path': record['path'],
+                'video_list': dict(
+                    (str(file_id), file_name)
+                    for file_id, file_name in record['video_list'].items())}))
 
 
 def createStructureEntry(ID, structure, folder_path, video_list):
@@ -162,40 +192,68 @@ def get_new_file_ids_from_structure(structure, video_db):
     Returns the list of videos found in structure but not in the db,
     meaning they are new.
     Input:  - structure as dict
-            - video_db as shelve object
+            - video_db as VideoStore
     Output: dict with file_id as keys and file_path as values
     """
     video_ids = {}
     for folder_id in structure.keys():
         for file_id, file_name in structure[folder_id]['video_list'].items():
-            if(file_id not in video_db.keys()):
+            if(file_id not in video_db):
                 video_ids[file_id] = os.path.join(
                     structure[folder_id]['path'],
                     file_name)
     return(video_ids)
 
 
-def check_and_correct_videos_errors(video_ids, video_db, local, ffmpeg):
+def check_and_correct_videos_errors(video_ids, video_db, local, ffmpeg, caches=None,
+                                    force=False):
     """Function that checks and corrects for errors in videos.
 
     It loops through a list of video ids, uses checkVideoIntegrity
     to checks if they contain errors or are corrupted
     and calls correct_video on them.
+    Checks and re-encodes run local['ffmpeg_processes'] at a time,
+    files are moved in file ID order once every check is done.
     Input:  - video_ids as list of video ids
-            - video_db as shelve object
+            - video_db as VideoStore
             - local as local config dict
             - ffmpeg as ffmpeg config dict
-    Ouput: NA
+            - caches as dict of caches (optional)
+            - force as Bool, re-checks files already verified clean
+    Ouput: True if some files were moved or re-encoded
     """
-    for file_id in video_ids.keys():
-        state = checkVideoIntegrity(
+    file_ids = sorted(video_ids)
+    states = run_in_pool(
+        lambda file_id: checkVideoIntegrity(
             video_ids[file_id],
-            local)
-        correct_video(state, video_ids[file_id], file_id, local, ffmpeg)
+            local,
+            file_id,
+            caches,
+            force),
+        file_ids,
+        local['ffmpeg_processes'])
+    changed = False
+    to_convert = []
+    for file_id, state in zip(file_ids, states):  # Moves stay sequential
+        conversion = correct_video(state, video_ids[file_id], file_id, local, ffmpeg)
+        if(conversion is not None):
+            to_convert.append(conversion)
+        changed = changed or state != 'clean'
+    populate_videos_details([video for video, output_file in to_convert], local, caches)
+    run_in_pool(
+        lambda conversion: fix_video(conversion[0], ffmpeg, local, conversion[1]),
+        to_convert,
+        local['ffmpeg_processes'])
+    return(changed)
 
 
 def correct_video(state, file_path, file_id, local, ffmpeg):
-    """Function that deals with errors in videos or corrupted videos."""
+    """Function that deals with errors in videos or corrupted videos.
+
+    Corrupted videos are moved into a corrupted folder. Videos with
+    errors are moved into an errors folder and have to be re-encoded.
+    Output: (Video, output_file) to re-encode or None
+    """
     folder_path = os.path.dirname(file_path)
     if(state == 'corrupt'):  # Move the file into corrupted folder
         if(not os.path.exists(os.path.join(folder_path, 'corrupted'))):
@@ -211,52 +269,82 @@ def correct_video(state, file_path, file_id, local, ffmpeg):
             os.path.basename(file_path))
         os.rename(file_path, new_file_path)
         temp_vid = Video(file_id, new_file_path, category='error')
-        temp_vid.populate_video_details(local)
-        temp_vid.baseConvertVideo(
-            ffmpeg,
-            local,
-            os.path.splitext(file_path)[0] + '.mp4')
+        return((temp_vid, os.path.splitext(file_path)[0] + '.mp4'))
+    return(None)
 
 
-def read_structure(local):
+def read_structure(local, caches=None, snapshot=None):
     """Function that reads the structure of the dirs of the videos.
 
-    Input: Base dirs as lit
+    Every video of every folder is hashed through one bounded pool of
+    local['scan_workers'] threads.
+    Input:  - local as local config dict
+            - caches as dict of caches (optional)
+            - snapshot as LibrarySnapshot (optional, scanned if missing)
     Output: Dict of dir structure of videos
     """
     structure = {}
-    root_dir = local['root_dir']
-    for i in os.walk(root_dir):
-        print(i[2])
-        if(len(i[0].split('/')) - 2 == len(root_dir.split('/')) and
-            re.match(r'^[0-9]{4}$', i[0].split('/')[-2]) and
-                len(i[2]) != 0):  # is not empty
-            ID, video_list = create_folder_id(i[0], local)
-            if(ID == ''):
-                continue
-            else:
-                createStructureEntry(
-                    ID,
-                    structure,
-                    i[0].decode('utf-8'),
-                    video_list)
+    if(snapshot is None):
+        snapshot = scan_library(local)
+    folders = [
+        (folder_path, sorted(videos))
+        for folder_path, videos in snapshot.folders]
+    file_paths = [
+        (os.path.join(folder_path, file_name), file_stat)
+        for folder_path, videos in folders
+        for file_name, file_stat in videos]
+    file_ids = iter(run_in_pool(
+        lambda entry: get_file_id(entry[0], caches, entry[1]),
+        file_paths,
+        local['scan_workers']))
+    for folder_path, videos in folders:
+        ID, video_list = build_folder_id(
+            [file_name for file_name, file_stat in videos],
+            [next(file_ids) for video in videos])
+        if(ID == ''):
+            continue
+        else:
+            createStructureEntry(
+                ID,
+                structure,
+                folder_path.decode('utf-8'),
+                video_list)
     return(structure)
 
 
+def refresh_structure(structure, folder_paths, local, caches=None):
+    """Function that re-reads some folders of a structure.
+
+    Only the given event folders are listed and hashed,
+    every other entry of the structure is kept as is.
+    Input:  - structure as dict
+            - folder_paths as list of strings
+            - local as local config dict
+            - caches as dict of caches (optional)
+    Output: new structure as dict
+    """
+    unicode_paths = set(folder_path.decode('utf-8') for folder_path in folder_paths)
+    new_structure = dict(
+        (ID, entry) for ID, entry in structure.items()
+        if entry['path'] not in unicode_paths)
+    new_structure.update(read_structure(
+        local,
+        caches,
+        scan_folders(local, folder_paths)))
+    return(new_structure)
+
+
 def clean_video_db(video_db):
     """Clean video db.
 
     Checks for videos that belong to any other category than normal
     and deletes them from the db
-    Input:  - video_db as shelve object
+    Input:  - video_db as VideoStore
     Output: NA
     """
-    for file_id in video_db:
-        if(video_db[file_id].category == 'normal' or
-                video_db[file_id].category == 'long'):
-            pass
-        else:
-            del(video_db[file_id])
+    deleted = video_db.delete_categories_except(('normal', 'long'))
+    if(deleted != 0):
+        logger.info('{} temporary videos removed from the db'.format(deleted))
 
 
 def multiple_formats(video_list, video_db):
@@ -301,11 +389,13 @@ def choose_format(video_list, video_db):
     return(formats)
 
 
-def checkDetailsCompatibility(structure, folder_id, video_db, ffmpeg, local, remote):
+def checkDetailsCompatibility(structure, folder_id, video_db, ffmpeg, local, remote,
+                              caches=None):
     """
     Function that checks that every video in one folder have the same
     resolution or framerate.
     If not, converts to the lowest standard of the different possibilities.
+    The conversions of the folder all go to the transcode scheduler at once.
     Input: folder_info as dict of video details
     Output: changes as Bool
     """
@@ -317,37 +407,151 @@ def checkDetailsCompatibility(structure, folder_id, video_db, ffmpeg, local, rem
             'compatibility')
         os.makedirs(comp_folder)
         formats = choose_format(videos, video_db)
-        for file_id in videos:
-            if(video_db[file_id].frame_rate != formats['frame_rate'] or
-                    video_db[file_id].width != formats['width'] or
-                    video_db[file_id].height != formats['height'] or
-                    video_db[file_id].video_codec != formats['video_codec'] or
-                    video_db[file_id].audio_codec != formats['audio_codec']):
-                target_file_path = video_db[file_id].convertVideo(
-                    ffmpeg,
-                    local,
-                    formats,
-                    comp_folder)
-                temp_file_id = create_file_id(target_file_path)
-                video_db[temp_file_id] = Video(
-                    temp_file_id,
-                    target_file_path,
-                    'compatibility')
-                video_db[temp_file_id].populate_video_details(local)
-                video_list.append(temp_file_id)
-            else:
-                video_list.append(file_id)
+        to_convert = [
+            video_db[file_id] for file_id in videos
+            if choose_conversion(video_db[file_id], formats) != 'copy']
+        target_file_paths = get_scheduler(local).run(
+            lambda video: convert_for_compatibility(
+                video, ffmpeg, local, formats, comp_folder, caches),
+            to_convert)
+        converted = []
+        converted_ids = {}
+        for video, target_file_path in zip(to_convert, target_file_paths):
+            if(target_file_path is None or not os.path.isfile(target_file_path)):
+                continue
+            temp_file_id = get_file_id(target_file_path, caches)
+            converted.append(Video(
+                temp_file_id,
+                target_file_path,
+                'compatibility'))
+            converted_ids[video.file_id] = temp_file_id
+        video_list = [converted_ids.get(file_id, file_id) for file_id in videos]
+        if(len(converted) != len(to_convert) or
+                len(populate_videos_details(converted, local, caches)) != 0):
+            logger.info('Folder {} has some errors for converting'.format(
+                structure[folder_id]['path'].encode('utf-8')))
+            shutil.rmtree(comp_folder)
+            return
+        with video_db.batch():
+            for video in converted:
+                video_db[video.file_id] = video
     else:
         video_list = videos
     sorted_video_list = get_video_order(video_list, video_db, by='file_name')
     createChaptersList(structure[folder_id]['path'], video_db, sorted_video_list)
-    createLongVideo(structure[folder_id]['path'], sorted_video_list, local, remote, video_db)
+    createLongVideo(structure[folder_id]['path'], sorted_video_list, local, remote, video_db,
+                    caches)
     try:
         shutil.rmtree(comp_folder)
     except:
         pass
 
 
+def choose_conversion(video, formats):
+    """
+    Function that decides the cheapest way to bring a video to a format.
+    Input:  - video as Video (probed)
+            - formats as dict (see choose_format)
+    Output: - 'copy' if both streams match and can be copied as they are
+            - 'audio' if the video stream can be copied, audio re-encoded
+            - 'encode' if the video stream has to be re-encoded
+    """
+    video_matches = (
+        video.video_codec == formats['video_codec'] and
+        video.width == formats['width'] and
+        video.height == formats['height'] and
+        video.frame_rate == formats['frame_rate'])
+    if(not video_matches):
+        return('encode')
+    if(video.audio_codec != formats['audio_codec']):
+        return('audio')
+    return('copy')
+
+
+def log_conversion(video, path):
+    """Function that logs the conversion path chosen for a video."""
+    logger.info('[CONVERSION] {}: {}'.format(video.file_path.encode('utf-8'), path))
+
+
+def conversion_key(video, formats, ffmpeg, path):
+    """
+    Function that returns the key of a conversion in the conversion cache:
+    a hash of the source file ID, the target format, the ffmpeg settings
+    and the conversion path.
+    Output: key as string
+    """
+    description = json.dumps([
+        video.file_id,
+        formats['width'],
+        formats['height'],
+        formats['frame_rate'],
+        formats['video_codec'],
+        formats['audio_codec'],
+        ffmpeg['vcodec'],
+        ffmpeg['acodec'],
+        ffmpeg['preset'],
+        ffmpeg['crf'],
+        path])
+    return(hashlib.sha1(description.encode('utf-8')).hexdigest())
+
+
+def convert_for_compatibility(video, ffmpeg, local, formats, comp_folder, caches=None):
+    """
+    Function that brings a video to the format of its folder, copying
+    its video stream when it already matches. Videos whose streams all
+    match are used as they are and never get here.
+    Conversions are reused from, and stored into, the conversion cache.
+    Output: path of the converted video as string
+    """
+    path = choose_conversion(video, formats)
+    if(caches is not None):
+        key = conversion_key(video, formats, ffmpeg, path)
+        cached_file = caches['conversions'].get(key)
+        if(cached_file is not None):
+            log_conversion(video, 'cached ' + path)
+            return(cached_file)
+    log_conversion(video, path)
+    if(path == 'encode'):
+        output_file = video.convertVideo(ffmpeg, local, formats, comp_folder)
+    else:
+        output_file = os.path.join(
+            comp_folder,
+            os.path.splitext(os.path.basename(video.file_path))[0] + '.mp4')
+        video.remuxVideo(ffmpeg, local, output_file, encode_audio=(path == 'audio'))
+    if(caches is not None and os.path.isfile(output_file)):
+        return(caches['conversions'].put(key, output_file))
+    return(output_file)
+
+
+def fix_video(video, ffmpeg, local, output_file):
+    """
+    Function that rewrites a video that has errors. When its streams
+    are already h264/aac, they are copied into a new container first,
+    which fixes container and timestamp errors. The copy keeps the same
+    bitstream, so it is checked with a full decode, the tier that flagged
+    the video. The full re-encode runs when streams are not compatible
+    or the copy still has errors.
+    Input: video as Video (moved in errors), output_file as string
+    Output: None
+    """
+    path = choose_conversion(video, {
+        'width': video.width,
+        'height': video.height,
+        'frame_rate': video.frame_rate,
+        'video_codec': 'h264',
+        'audio_codec': 'aac'})
+    if(path != 'encode'):
+        video.remuxVideo(ffmpeg, local, output_file, encode_audio=(path == 'audio'))
+        if(os.path.isfile(output_file) and
+                check_integrity_tiers(output_file, local, full=True)[0] == 'clean'):
+            log_conversion(video, path)
+            return
+        logger.info('{} still has errors after {}'.format(
+            video.file_path.encode('utf-8'), path))
+    log_conversion(video, 'encode')
+    video.baseConvertVideo(ffmpeg, local, output_file)
+
+
 def get_video_order(file_ids, video_db, by):
     video_path_list = {}
     sorted_ids = []
@@ -435,18 +639,24 @@ def format_html(old_path, present_path, action, **file_paths):
     return(html_string)
 
 
-def updateStructure(past_structure, new_structure, local, ffmpeg, remote, video_db):
+def updateStructure(past_structure, new_structure, local, ffmpeg, remote, video_db,
+                    caches=None, store=None):
     """
     Function that compares two structures looking
-    for new,modified,deleted folders/files
-    Input: past_structure as dict, new_structure as dict
-    Output: None, changes strucure in place
+    for new,modified,deleted folders/files (see diff_structures)
+    New and modified folders are processed local['folder_workers'] at
+    a time, their conversions share the transcode scheduler. Their
+    results are written to the structure by the calling thread only.
+    Every folder processed is recorded in the structure store journal,
+    without a store the structure file is written once at the end.
+    Input: past_structure as dict, new_structure as dict,
+           store as StructureStore (optional)
+    Output: html report as dict
     """
     html_report = {'new': '', 'modified': '', 'moved': '', 'deleted': ''}
     if(new_structure == past_structure):
         logger.info('No changes found')
         return(html_report)
-    new_paths = getPathList(new_structure)
     new_file_ids = set()
     for struct_id in new_structure:
         for file_id in new_structure[struct_id]['video_list']:
@@ -454,70 +664,74 @@ def updateStructure(past_structure, new_structure, local, ffmpeg, remote, video_
     a = set(video_db.keys())
     b = new_file_ids
     diff = a - b
-    for file_id in diff:
-        if(video_db[file_id].category != 'long'):
+    diff -= set(video_db.select('category', 'long'))  # Long versions are kept
+    with video_db.batch():
+        for file_id in diff:
             del(video_db[file_id])
-    present_structure = copy.deepcopy(past_structure)
-    for ID in past_structure.keys():
-        if ID == '':  # Empty folder
-            continue
-        if ID in new_structure.keys():  # Hash found in the new struct
-            if (past_structure[ID]['path'] == new_structure[ID]['path']):
-                continue
-            else:  # Folder moved
-                old_path = past_structure[ID]['path'].encode('utf-8')
-                new_path = new_structure[ID]['path'].encode('utf-8')
-                logger.info('{} [MOVED] to ------> {}'.format(
-                    old_path,
-                    new_path))
-                html_report['moved'] += format_html(old_path, new_path, action='moved')
-                for file_id, file_name in new_structure[ID]['video_list'].items():
-                    video_db[file_id].file_path = os.path.join(new_path.decode('utf-8'), file_name)
-                present_structure[ID]['path'] = new_structure[ID]['path']
-                if(not mkv_in_local(past_structure[ID]['path'], present_structure[ID]['path'])):
-                    moveLongVideo(past_structure[ID]['path'], present_structure[ID]['path'], local, remote)
-        else:  # Hash missing in the new struct. Deleted or modified
-            if(past_structure[ID]['path'] in new_paths):  # Modified
-                folder_path = past_structure[ID]['path']
-                logger.info('[MODIFIED] {}'.format(folder_path.encode('utf-8')))
-                new_files = [
-                    new for new in list_video_files(folder_path, local)
-                    if new not in past_structure[ID]['video_list'].values()]
-                del_files = [
-                    deleted for deleted in past_structure[ID]['video_list'].values()
-                    if deleted not in list_video_files(folder_path, local)]
-                html_report['modified'] += format_html('', folder_path, action='modified', new_files=new_files, del_files=del_files)
-                new_ID, video_list = create_folder_id(folder_path.encode('utf-8'), local)
-                present_structure = process_folder(
-                    new_structure,
-                    present_structure,
-                    new_ID,
-                    video_db,
-                    ffmpeg,
-                    local,
-                    remote)
-                del(present_structure[ID])
-            else:  # No hash and no path -> Deleted
-                folder_path = past_structure[ID]['path'].encode('utf-8')
-                logger.info("[DELETED]  {}".format(folder_path))
-                html_report['deleted'] += format_html('', folder_path, action='deleted')
-                del present_structure[ID]
-        write_structure(present_structure, CONSTANTS['structure_file_path'])
-    present_paths = getPathList(present_structure)  # Get list pf paths
-    for new_ID in new_structure.keys():
-        if(new_ID not in present_structure.keys() and new_structure[new_ID]['path'] not in present_paths):
-            folder_path = new_structure[new_ID]['path']
-            logger.info("[NEW]   {}".format(folder_path.encode('utf-8')))
-            html_report['new'] += format_html('', folder_path, action='new')
-            present_structure = process_folder(
-                new_structure,
-                present_structure,
-                new_ID,
-                video_db,
-                ffmpeg,
-                local,
-                remote)
-        write_structure(present_structure, CONSTANTS['structure_file_path'])
+    present_structure = dict(past_structure)  # Entries are replaced, never changed
+    changes = diff_structures(past_structure, new_structure)
+    for change in changes.moved + changes.deleted:
+        if(change.kind == MOVED):
+            old_path = change.old_path.encode('utf-8')
+            new_path = change.path.encode('utf-8')
+            logger.info('{} [MOVED] to ------> {}'.format(
+                old_path,
+                new_path))
+            html_report['moved'] += format_html(old_path, new_path, action='moved')
+            with video_db.batch():
+                for file_id, file_name in new_structure[change.ID]['video_list'].items():
+                    video = video_db[file_id]
+                    video.file_path = os.path.join(change.path, file_name)
+                    video_db[file_id] = video
+            present_structure[change.ID] = {
+                'path': change.path,
+                'video_list': past_structure[change.ID]['video_list']}
+            if(store is not None):
+                store.moved(change.ID, change.path)
+            if(not mkv_in_local(change.old_path, change.path)):
+                moveLongVideo(change.old_path, change.path, local, remote)
+        elif(change.kind == DELETED):
+            folder_path = change.old_path.encode('utf-8')
+            logger.info("[DELETED]  {}".format(folder_path))
+            html_report['deleted'] += format_html('', folder_path, action='deleted')
+            del present_structure[change.ID]
+            if(store is not None):
+                store.deleted(change.ID)
+    folders = changes.modified + changes.new
+    for change in folders:
+        if(change.kind == MODIFIED):
+            logger.info('[MODIFIED] {}'.format(change.path.encode('utf-8')))
+            html_report['modified'] += format_html(
+                '', change.path, action='modified',
+                new_files=change.added, del_files=change.removed)
+        else:
+            logger.info("[NEW]   {}".format(change.path.encode('utf-8')))
+            html_report['new'] += format_html('', change.path, action='new')
+    results = run_as_completed(
+        lambda change: process_folder(
+            new_structure,
+            {},
+            change.new_ID,
+            video_db,
+            ffmpeg,
+            local,
+            remote,
+            caches).get(change.new_ID),
+        folders,
+        local['folder_workers'])
+    for change, entry in results:  # Only this thread writes the structure
+        if(change.kind == MODIFIED):
+            del(present_structure[change.ID])
+            if(entry is not None):
+                present_structure[change.new_ID] = entry
+            if(store is not None):
+                store.modified(change.ID, change.new_ID, entry)
+        elif(entry is not None):
+            present_structure[change.new_ID] = entry
+            if(store is not None):
+                store.new(change.new_ID, entry)
+    if(store is None):
+        write_structure(present_structure, CONSTANTS['structure_store_path'])
     logger.info('Structure updated')
     return(html_report)
 
@@ -531,33 +745,47 @@ def mkv_in_local(old_path, new_path):
         return(False)
 
 
-def process_folder(structure, present_structure, folder_id, video_db, ffmpeg, local, remote):
+def process_folder(structure, present_structure, folder_id, video_db, ffmpeg, local, remote,
+                   caches=None):
     folder_path = structure[folder_id]['path']
     createStructureEntry(
         folder_id,
         present_structure,
         folder_path,
         structure[folder_id]['video_list'])
+    new_videos = []
     for file_id, file_name in present_structure[folder_id]['video_list'].items():
-        state = (file_id in video_db)
-        updateVideoDB(video_db, ffmpeg, local, file_id, file_name, state, folder_path)
-    checkDetailsCompatibility(present_structure, folder_id, video_db, ffmpeg, local, remote)
+        if(file_id in video_db):
+            updateVideoDB(video_db, file_id, file_name, folder_path)
+        else:
+            new_videos.append(Video(
+                file_id,
+                os.path.join(folder_path, file_name),
+                category='normal'))
+    failed = populate_videos_details(new_videos, local, caches)
+    if(len(failed) != 0):  # Left out of the structure to be retried next run
+        logger.info('Folder {} skipped, {} videos could not be probed'.format(
+            folder_path.encode('utf-8'), len(failed)))
+        del(present_structure[folder_id])
+        return(present_structure)
+    with video_db.batch():
+        for video in new_videos:
+            video_db[video.file_id] = video
+    checkDetailsCompatibility(present_structure, folder_id, video_db, ffmpeg, local, remote,
+                              caches)
     return(present_structure)
 
 
-def updateVideoDB(video_db, ffmpeg, local, file_id, file_name, state, folder_path):
+def updateVideoDB(video_db, file_id, file_name, folder_path):
     """
-    Updates video db with the new videos.
+    Function that updates the path of a video already in the video DB.
+    New videos are probed together by process_folder.
+    Input: video_db as VideoStore, file_id, file_name, folder_path as strings
+    Output: None
     """
-    if(not state):  # Store
-        temp_vid = Video(
-            file_id,
-            os.path.join(folder_path, file_name),
-            category='normal')
-        temp_vid.populate_video_details(local)
-        video_db[temp_vid.file_id] = temp_vid
-    else:  # Already in our video DB
-        video_db[file_id].file_path = os.path.join(folder_path, file_name)
+    video = video_db[file_id]
+    video.file_path = os.path.join(folder_path, file_name)
+    video_db[file_id] = video
 
 
 def video_in_db(video_db, file_id):
@@ -567,40 +795,112 @@ def video_in_db(video_db, file_id):
         return('new')
 
 
-def checkVideoIntegrity(file_path, local):
+def checkVideoIntegrity(file_path, local, file_id=None, caches=None, force=False):
     """
-    Checks if video is corrupted or contains errors
+    Checks if video is corrupted or contains errors.
+    Files already verified clean by the same ffmpeg version (with a full
+    decode when integrity_mode is 'full') are not checked again unless
+    force is True. Every new verdict is stored.
     """
-    cmd = "'{}' -show_streams -show_format -print_format json '{}'".format(
-        local['ffprobe_executable_path'],
-        file_path.encode('utf-8'))
-    (stdout, err) = executeCommand(cmd)
-    if(re.findall('Invalid data found when processing input', err)):
-        return('corrupt')
-    cmd = "'{}' -v error -i '{}' -f null -".format(
+    if(caches is not None and file_id is not None and not force):
+        verdict = caches['verdicts'].get(file_id, file_path, local['ffmpeg_version'])
+        if(verdict is not None and verdict['state'] == 'clean' and
+                (verdict['tier'] == 'full' or local['integrity_mode'] != 'full')):
+            log_integrity(file_path, 'cached ' + verdict['tier'], 'clean')
+            return('clean')
+    (state, tier) = check_integrity_tiers(file_path, local, file_id, caches)
+    if(caches is not None and file_id is not None):
+        caches['verdicts'].set(file_id, file_path, state, local['ffmpeg_version'], tier)
+    return(state)
+
+
+def check_integrity_tiers(file_path, local, file_id=None, caches=None, full=False):
+    """
+    In 'tiered' integrity_mode, a container check (the cached ffprobe run)
+    and a decode of a few short windows spread across the file run first.
+    The full decode only runs when one of them flags something,
+    or always in 'full' integrity_mode or when full is True.
+    Output: (state, tier that gave it) as strings
+    """
+    probe = probe_file(file_path, local, file_id, caches)
+    if(probe['invalid']):
+        log_integrity(file_path, 'container', 'corrupt')
+        return('corrupt', 'container')
+    if(local['integrity_mode'] != 'full' and not full):
+        if(not container_is_sound(probe['data'])):
+            log_integrity(file_path, 'container', 'suspect')
+        else:
+            log_integrity(file_path, 'container', 'clean')
+            duration = duration_to_seconds(probe['data']['format'].get('duration'))
+            if(sampled_decode_is_clean(file_path, duration, local)):
+                log_integrity(file_path, 'sampled', 'clean')
+                return('clean', 'sampled')
+            log_integrity(file_path, 'sampled', 'suspect')
+    cmd = "'{}' -v error -threads {} -i '{}' -f null -".format(
         local['ffmpeg_executable_path'],
+        local['ffmpeg_threads'],
         file_path.encode('utf-8'))
-    (stdout, err) = executeCommand(cmd)
-    #print('stdout: ', stdout)
-    #print('err: ', err)
-    #if(re.findall('Invalid data found when processing input', err)):
-        #return('corrupt')
+    (stdout, err) = executeCommand(cmd, 'heavy')
     if(err != ''):
-        return('error')
+        state = 'error'
     else:
-        return('clean')
+        state = 'clean'
+    log_integrity(file_path, 'full', state)
+    return(state, 'full')
 
 
-def getPathList(structure):
+def get_ffmpeg_version(local):
     """
-    Function that gets le list of existing paths in a structure
-    Input: Structure as dict
-    Output: paths as list of strings
+    Function that returns the version line of the ffmpeg in use, so that
+    integrity verdicts given by another ffmpeg are not trusted
+    Input: local as local config dict
+    Output: version as string
     """
-    paths = []
-    for ID in structure.keys():
-        paths.append(structure[ID]['path'])
-    return(paths)
+    (stdout, err) = executeCommand("'{}' -version".format(
+        local['ffmpeg_executable_path']))
+    return(stdout.split('\n')[0].strip())
+
+
+def log_integrity(file_path, tier, verdict):
+    """Function that logs the verdict of one tier of the integrity check."""
+    logger.info('[INTEGRITY] {} {}: {}'.format(
+        file_path.encode('utf-8'), tier, verdict))
+
+
+def container_is_sound(probe_data):
+    """
+    Function that checks the ffprobe output of a file: it needs a
+    video stream and a known duration to be sampled.
+    Input: probe_data as parsed ffprobe json
+    Output: Bool
+    """
+    streams = probe_data.get('streams') or []
+    if(not any(stream.get('codec_type') == 'video' for stream in streams)):
+        return(False)
+    return(duration_to_seconds(probe_data.get('format', {}).get('duration')) is not None)
+
+
+def sampled_decode_is_clean(file_path, duration, local):
+    """
+    Function that decodes local['integrity_samples'] windows of
+    local['integrity_sample_seconds'] spread evenly across a video.
+    Input: file_path as string, duration in seconds as float
+    Output: True if no window reported an error
+    """
+    samples = local['integrity_samples']
+    window = local['integrity_sample_seconds']
+    for n in range(samples):
+        start = max(0.0, duration * (n + 0.5) / samples - window / 2.0)
+        cmd = "'{}' -v error -threads {} -ss {:.3f} -i '{}' -t {} -f null -".format(
+            local['ffmpeg_executable_path'],
+            local['ffmpeg_threads'],
+            start,
+            file_path.encode('utf-8'),
+            window)
+        (stdout, err) = executeCommand(cmd, 'heavy')
+        if(err != ''):
+            return(False)
+    return(True)
 
 
 def syncDirTree(local, remote):
@@ -616,43 +916,188 @@ def syncDirTree(local, remote):
             local['root_dir'] + '/', remote['root_dir'] + '/'))
 
 
-def transferLongVersions(local, remote, video_db):
+def transferLongVersions(local, remote, video_db, snapshot=None):
     """
-    Function that looks for mkv movies and sends them
-    to the remote media player
+    Function that looks for mkv movies and queues their transfer
+    to the remote media player, then runs the remote jobs of the queue
+    (transfers and moves), the ones left by an interrupted run included
     Input: None
     Output: None
     """
-    long_videos_path = []
-    root_dir = local['root_dir']
-    for i in os.walk(root_dir):
-        if(len(i[0].split('/')) - 2 == len(root_dir.split('/'))  # 2 levels
-                and re.match(r'^[0-9]{4}$', i[0].split('/')[-2])  # match year
-                and len(i[2]) != 0):
-            for video in i[2]:
-                if(os.path.splitext(video)[1] == '.mkv'
-                        and os.path.splitext(video)[0] == os.path.basename(i[0])):
-                    long_videos_path.append(os.path.join(i[0], video))
-    for video in long_videos_path:
-        #  if(os.splitext(video_db[create_file_id(video)].file_name)[0] == ):
-        #print(video)
-        #print(os.path.join(video.replace(local['root_dir'], remote['root_dir'])))
-        try:
-            shutil.move(
-                video,
-                os.path.join(video.replace(local['root_dir'], remote['root_dir'])))
-        except Exception:
-            logger.info(traceback.format_exc())
+    if(snapshot is None):
+        snapshot = scan_library(local)
+    queue = get_queue()
+    for video in list(snapshot.long_versions):
+        destination = to_unicode(video.replace(local['root_dir'], remote['root_dir']))
+        depends_on = [
+            job['id'] for job in queue.unfinished('remote_move')
+            if destination in (job['args']['source'], job['args']['destination'])]
+        queue.add(
+            'transfer',
+            {'source': to_unicode(video), 'destination': destination},
+            key='transfer:' + destination,
+            depends_on=depends_on)
+        snapshot.forget(video)
+    run_remote_jobs(local)
     logger.info("Long versions have been moved to remote")
 
 
-def createLongVideo(folder_path, video_list, local, remote, video_db):
+def move_file_job(args):
+    """
+    Function that moves a file for the job queue (remote_move).
+    A job whose file is already at its destination is done, so a job
+    interrupted after the move is not failed when resumed.
+    Input: args as dict with 'source' and 'destination'
+    Output: Bool, True when the file is at its destination
+    """
+    source = args['source'].encode('utf-8')
+    destination = args['destination'].encode('utf-8')
+    if(not os.path.exists(source)):
+        logger.info('{} already moved'.format(source))
+        return(os.path.exists(destination))
+    shutil.move(source, destination)
+    logger.info('{} moved to {}'.format(source, destination))
+    return(True)
+
+
+def transfer_file_job(args):
+    """
+    Function that sends a long version to the remote media player for the
+    job queue (transfer), resuming the copy left by an interrupted attempt
+    (see transfer_file)
+    Input: args as dict with 'source' and 'destination'
+    Output: Bool, True when the file is at its destination
+    """
+    source = args['source'].encode('utf-8')
+    destination = args['destination'].encode('utf-8')
+    if(not os.path.exists(source)):
+        logger.info('{} already moved'.format(source))
+        return(os.path.exists(destination))
+    return(transfer_file(source, destination))
+
+
+def run_remote_jobs(local):
+    """
+    Function that runs the jobs of the queue that need the remote media
+    player to be mounted
+    Input: local as local config dict
+    Output: None
+    """
+    failed = get_queue().run(
+        {'transfer': transfer_file_job, 'remote_move': move_file_job},
+        local['transfer_workers'])
+    if(failed != 0):
+        logger.info('{} remote jobs failed, they will be retried next run'.format(failed))
+
+
+def find_previous_long_version(folder_path, video_db, caches=None):
+    """
+    Function that looks for the long version built the last time a folder
+    was processed, in the folder itself. It is only there when its
+    transfer to the remote media player failed. Long versions already
+    sent are not used: mkvmerge would read the whole file over the
+    network, more than rebuilding from the local clips.
+    Input:  - folder_path as unicode
+            - video_db as VideoStore
+    Output: (Video, file path as string) or (None, None)
+    """
+    file_path = os.path.join(
+        folder_path, os.path.basename(folder_path) + '.mkv').encode('utf-8')
+    if(not os.path.isfile(file_path)):
+        return(None, None)
+    file_id = get_file_id(file_path, caches)
+    if(file_id in video_db and getattr(video_db[file_id], 'source_ids', None)):
+        return(video_db[file_id], file_path)
+    return(None, None)
+
+
+def can_append(source_ids, video_list):
+    """
+    Function that tells if a long version can be extended instead of
+    rebuilt: its clips are still the first ones, in the same order.
+    Input: source_ids, video_list as lists of file IDs
+    Output: Bool
+    """
+    return(len(video_list) > len(source_ids) and
+           video_list[:len(source_ids)] == list(source_ids))
+
+
+def appendLongVideo(folder_path, previous, previous_path, video_list, local, video_db,
+                    caches=None):
+    """
+    Function that runs mkvmerge to add the new clips at the end of the
+    previous long version. The chapters of the previous long version are
+    dropped and replaced by the chapter file of the whole list.
+    Long versions are normally moved to the remote media player once
+    built, so this only happens when that transfer failed and the
+    previous long version is still in the folder.
+    The result is written next to it and replaces it only if its
+    duration is the previous one plus the duration of the new clips,
+    otherwise the previous long version is left untouched.
+    Input:  - folder_path as unicode
+            - previous as Video, previous_path as string
+            - video_list as list of file IDs
+    Output: Bool, False when a full rebuild is needed
+    """
+    new_ids = video_list[len(previous.source_ids):]
+    chapters_file_path = os.path.join(folder_path, CONSTANTS['chapters_file_name'])
+    output_file = os.path.join(folder_path, os.path.basename(folder_path) + '.mkv')
+    temp_file = os.path.join(folder_path, os.path.basename(folder_path) + '.append.mkv')
+    file_in = "--no-chapters '{}'".format(previous_path)
+    for file_id in new_ids:
+        file_in += " + '{}'".format(video_db[file_id].file_path.encode('utf-8'))
+    command = "{} --quiet --chapters '{}' -o '{}' {}".format(
+        local['mkvmerge_executable_path'].encode('utf-8'),
+        chapters_file_path.encode('utf-8'),
+        temp_file.encode('utf-8'),
+        file_in)
+    executeCommand(command, 'heavy')
+    if(not os.path.isfile(temp_file)):
+        return(False)
+    output_file_id = create_file_id(temp_file)  # Content hash, kept by the rename
+    temp_vid = Video(output_file_id, temp_file, category='long')
+    expected = duration_to_seconds(previous.duration)
+    for file_id in new_ids:
+        duration = duration_to_seconds(video_db[file_id].duration)
+        expected = None if None in (expected, duration) else expected + duration
+    if(len(populate_videos_details([temp_vid], local, caches)) != 0 or
+            expected is None or
+            duration_to_seconds(temp_vid.duration) is None or
+            abs(duration_to_seconds(temp_vid.duration) - expected) > len(new_ids)):
+        logger.info('[APPEND] {}: long version does not match its clips'.format(
+            folder_path.encode('utf-8')))
+        os.remove(temp_file)
+        return(False)
+    os.rename(temp_file, output_file)
+    temp_vid.file_path = output_file
+    temp_vid.file_name = os.path.basename(output_file)
+    temp_vid.source_ids = list(video_list)
+    video_db[output_file_id] = temp_vid
+    logger.info('[APPEND] {}: {} clips appended'.format(
+        folder_path.encode('utf-8'), len(new_ids)))
+    return(True)
+
+
+def createLongVideo(folder_path, video_list, local, remote, video_db, caches=None):
     """
     Function that runs mkvmerge to create a long version of list of videos.
+    When the previous long version of the folder is still local, after a
+    failed transfer, and holds the first clips of the list, only the new
+    clips are appended to it (see appendLongVideo). Otherwise the whole
+    list is merged again.
     Needs a chapter file (see createChaptersList)
     Input: folder_info as dict
     Ouptut: None
     """
+    chapters_file_path = os.path.join(
+        folder_path, CONSTANTS['chapters_file_name'])
+    previous, previous_path = find_previous_long_version(folder_path, video_db, caches)
+    if(previous is not None and can_append(previous.source_ids, video_list)):
+        if(appendLongVideo(folder_path, previous, previous_path, video_list, local,
+                           video_db, caches)):
+            os.remove(chapters_file_path)
+            return
+        logger.info('Append failed for {}, rebuilding'.format(folder_path.encode('utf-8')))
     file_in = ''
     if(len(video_list) == 1):  # Only one video
         file_in += video_db[video_list[0]].file_path
@@ -661,8 +1106,6 @@ def createLongVideo(folder_path, video_list, local, remote, video_db):
             file_in += "'{}' + ".format(
                 video_db[file_id].file_path.encode('utf-8'))
         file_in = file_in.rstrip(' + ')
-    chapters_file_path = os.path.join(
-        folder_path, CONSTANTS['chapters_file_name'])
     output_file = os.path.join(
         folder_path,  # .encode('utf-8')
         os.path.basename(folder_path) + '.mkv')  # .encode('utf-8')
@@ -673,15 +1116,16 @@ def createLongVideo(folder_path, video_list, local, remote, video_db):
             folder_path,
             chapters_file_path).encode('utf-8'),
         output_file.encode('utf-8'))
-    stdout, err = executeCommand(command)
+    stdout, err = executeCommand(command, 'heavy')
     if(os.path.isfile(output_file)):
         output_file_id = create_file_id(output_file)
         temp_vid = Video(
             output_file_id,
             output_file,
             category='long')
-        temp_vid.populate_video_details(local)
-        video_db[output_file_id] = temp_vid
+        temp_vid.source_ids = list(video_list)
+        if(len(populate_videos_details([temp_vid], local, caches)) == 0):
+            video_db[output_file_id] = temp_vid
     else:
         logger.info('Folder {} has some errors for merging'.format(folder_path.encode('utf-8')))
     os.remove(chapters_file_path)
@@ -699,54 +1143,21 @@ def clean_remote(remote):
 
 def moveLongVideo(old_path, new_path, local, remote):
     """
-    Function that adds bash commands to move files on the remote storage
-    as strings into a file (default = /share/Scripts/todo.sh)
-    Input: old_path as string, new_path as string, todo_file_path as string
-    Ouptut: None
-    """
-    output_string = ''
-    old_file_path = "{}/{}.mkv".format(
-        os.path.join(
-            old_path.replace(local['root_dir'], remote['root_dir'])).encode('utf-8'),
-        os.path.basename(old_path).encode('utf-8'))
-    new_file_path = "{}/{}.mkv".format(
-        os.path.join(new_path.replace(local['root_dir'], remote['root_dir'])).encode('utf-8'),
-        os.path.basename(new_path).encode('utf-8'))
-    #  new_folder_path = new_path.replace(local['root_dir'], remote['root_dir'])
-    #  output_string += "mkdir '{}'\n".format(new_folder_path.encode('utf-8'))
-    output_string += "mv '{}' '{}'\n".format(
-        old_file_path,
-        new_file_path)
-    with open(CONSTANTS['todo_file_path'], "a+") as todo:
-        todo.write(output_string)
-
-
-def executeToDoFile(todo_file_path, local, CONSTANTS):
-    """
-    Function that runs each lines of todo.sh sequentially and erases them after
-    Input: todo_file_path as string
+    Function that queues the move of a long version on the remote storage
+    when its folder was moved (see run_remote_jobs)
+    Input: old_path as string, new_path as string
     Ouptut: None
     """
-    os.chdir(local['root_dir'])
-    logger.info("Executing todo file")
-    while 1:
-        with open(CONSTANTS['todo_file_path'], 'r') as f:
-            first = f.readline()
-            logger.info(first)
-            if(first == ''):
-                break
-            sub = subprocess.Popen(first, shell=True)
-            sub.wait()
-            if(sub.wait() != 0):
-                logger.info(sub.wait())
-        out = subprocess.Popen(
-            "sed '1d' '{}' > '{}'/tmpfile; mv tmpfile '{}'".format(
-                CONSTANTS['todo_file_path'],
-                local['root_dir'],
-                CONSTANTS['todo_file_path']), shell=True)
-        out.wait()
-    logger.info("Todo file done")
-    os.remove(CONSTANTS['todo_file_path'])
+    old_file_path = os.path.join(
+        old_path.replace(local['root_dir'], remote['root_dir']),
+        os.path.basename(old_path) + '.mkv')
+    new_file_path = os.path.join(
+        new_path.replace(local['root_dir'], remote['root_dir']),
+        os.path.basename(new_path) + '.mkv')
+    get_queue().add(
+        'remote_move',
+        {'source': to_unicode(old_file_path), 'destination': to_unicode(new_file_path)},
+        key='remote_move:' + to_unicode(old_file_path))
 
 
 def createChaptersList(folder_path, video_db, video_list):
@@ -817,20 +1228,6 @@ def umount(remote):
     executeCommand(command)
 
 
-def check_if_vid(file_path, local):
-    """
-    Function that checks if a file a video with known extension
-    Input: file_path as string, video_extensions as list of strings
-    Ouptut: Bool
-    """
-    for ext in local['video_extensions']:
-        if(file_path.endswith(ext) or file_path.endswith(ext.upper()) and
-                not re.match(r'^.*', file_path)):
-            return True
-    else:
-        return False
-
-
 def build_html_report(html_data, CONSTANTS, html):
     """
     Function that takes a dict with the folders that were
@@ -0,0 +1,217 @@
+# coding=utf-8
+"""Jobs.
+
+Persistent job queue. Every job is written to disk, with its state,
+before and after it runs, so a run that crashes or is stopped resumes
+the jobs it did not finish and skips the ones it did. A job only runs
+once the jobs it depends on are done, independent jobs run at the same
+time.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import traceback
+from CONSTANTS import CONSTANTS
+from caches import write_json_atomic
+from parallel import run_in_pool
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+MAX_ATTEMPTS = 3  # A job that failed this many times is left for a human
+
+queues = {}
+queues_lock = threading.Lock()
+
+
+def exhausted(job):
+    """Function that tells if a job failed MAX_ATTEMPTS times.
+
+    Exhausted jobs are kept to be reported, they block nothing and a
+    new job with the same key replaces them
+    """
+    return(job['state'] == FAILED and job['attempts'] >= MAX_ATTEMPTS)
+
+
+class JobQueue(object):
+    """Job queue.
+
+    Class that keeps the jobs in a json file. Jobs that were running when
+    the program stopped are pending again when the queue is loaded, failed
+    jobs are retried on the next run until MAX_ATTEMPTS
+    """
+
+    def __init__(self, file_path):
+        """__init__."""
+        self.file_path = file_path
+        self.jobs = {}
+        self.next_id = 1
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        """Load the queue from disk, resuming interrupted and failed jobs."""
+        if(not os.path.exists(self.file_path)):
+            return
+        try:
+            with open(self.file_path, 'r') as f:
+                data = json.load(f)
+        except Exception:
+            logger.info(traceback.format_exc())
+            logger.info('Job queue unreadable, starting empty')
+            return
+        self.jobs = data['jobs']
+        self.next_id = data['next_id']
+        for job in self.jobs.values():
+            if(job['state'] == RUNNING):
+                logger.info('Job {} ({}) was interrupted, resuming it'.format(
+                    job['id'], job['kind']))
+                job['state'] = PENDING
+            elif(job['state'] == FAILED and job['attempts'] < MAX_ATTEMPTS):
+                job['state'] = PENDING
+
+    def save(self):
+        """Write the queue to disk, forgetting the done jobs nobody waits for."""
+        with self.lock:
+            waited = set()
+            for job in self.jobs.values():
+                if(job['state'] != DONE):
+                    waited.update(job['depends_on'])
+            for job_id in list(self.jobs):
+                if(self.jobs[job_id]['state'] == DONE and job_id not in waited):
+                    del(self.jobs[job_id])
+            write_json_atomic(
+                {'next_id': self.next_id, 'jobs': self.jobs},
+                self.file_path)
+
+    def add(self, kind, args, key=None, depends_on=()):
+        """Add a job and return its ID.
+
+        A job with the same key that is not done yet is not added twice,
+        its ID is returned instead
+        """
+        with self.lock:
+            if(key is not None):
+                for job in list(self.jobs.values()):
+                    if(job['key'] != key or job['state'] == DONE):
+                        continue
+                    if(not exhausted(job)):
+                        return(job['id'])
+                    logger.info('Job {} ({}) left after {} attempts, replaced'.format(
+                        job['id'], job['kind'], job['attempts']))
+                    del(self.jobs[job['id']])
+            job_id = str(self.next_id)
+            self.next_id += 1
+            self.jobs[job_id] = {
+                'id': job_id,
+                'kind': kind,
+                'key': key,
+                'args': args,
+                'depends_on': [str(ID) for ID in depends_on],
+                'state': PENDING,
+                'attempts': 0,
+                'created': time.time(),
+                'updated': time.time()}
+            self.save()
+            logger.info('Job {} ({}) queued'.format(job_id, kind))
+            return(job_id)
+
+    def unfinished(self, kind):
+        """Return the jobs of a kind that are not done, nor exhausted."""
+        with self.lock:
+            return([
+                job for job in self.jobs.values()
+                if job['kind'] == kind and job['state'] != DONE and not exhausted(job)])
+
+    def exhausted(self):
+        """Return the jobs left for a human, sorted by ID."""
+        with self.lock:
+            return(sorted(
+                [job for job in self.jobs.values() if exhausted(job)],
+                key=lambda job: int(job['id'])))
+
+    def report_exhausted(self):
+        """Log the jobs left for a human, every run until they are replaced."""
+        for job in self.exhausted():
+            logger.info('Job {} ({}) failed {} times and is not retried: {}'.format(
+                job['id'], job['kind'], job['attempts'], json.dumps(job['args'])))
+
+    def ready(self, kinds):
+        """Return the pending jobs of some kinds whose dependencies are done.
+
+        Dependencies that are not in the queue anymore were done or
+        replaced, exhausted ones do not block either
+        """
+        def settled(ID):
+            dependency = self.jobs.get(ID)
+            return(dependency is None or dependency['state'] == DONE or
+                   exhausted(dependency))
+        with self.lock:
+            return(sorted(
+                [job for job in self.jobs.values()
+                 if job['kind'] in kinds and job['state'] == PENDING and
+                 all(settled(ID) for ID in job['depends_on'])],
+                key=lambda job: int(job['id'])))
+
+    def set_state(self, job, state):
+        """Change the state of a job and write the queue to disk."""
+        with self.lock:
+            job['state'] = state
+            job['updated'] = time.time()
+            if(state == FAILED):
+                job['attempts'] += 1
+            self.save()
+
+    def run(self, handlers, workers=1):
+        """Run every ready job that has a handler, until none is left.
+
+        Input:  - handlers as dict of kind -> function taking the job args
+                  and returning True when the job is done
+                - workers as int, jobs run at the same time
+        Output: number of jobs that failed
+        """
+        failed = 0
+        while True:
+            batch = self.ready(handlers)
+            if(len(batch) == 0):
+                break
+            for job in batch:
+                self.set_state(job, RUNNING)
+
+            def run_job(job):
+                try:
+                    return(bool(handlers[job['kind']](job['args'])))
+                except Exception:
+                    logger.info(traceback.format_exc())
+                    return(False)
+            results = run_in_pool(run_job, batch, workers)
+            for job, ok in zip(batch, results):
+                self.set_state(job, DONE if ok else FAILED)
+                if(not ok):
+                    failed += 1
+                    logger.info('Job {} ({}) failed, attempt {}'.format(
+                        job['id'], job['kind'], job['attempts']))
+        return(failed)
+
+
+def get_queue():
+    """Function that returns the job queue shared by the whole program.
+
+    Output: JobQueue
+    """
+    file_path = CONSTANTS['job_queue_path']
+    with queues_lock:
+        if(file_path not in queues):
+            queues[file_path] = JobQueue(file_path)
+        return(queues[file_path])
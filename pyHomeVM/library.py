@@ -0,0 +1,177 @@
+# coding=utf-8
+"""Library.
+
+Single pass walker of the video library. The library is laid out as
+root_dir/<year>/<event>/<videos>, so only the two levels below the root
+are ever read.
+"""
+import os
+import re
+import stat as stat_module
+import logging
+from CONSTANTS import CONSTANTS
+try:
+    from os import scandir
+except ImportError:  # python2, use the scandir backport when installed
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+YEAR_PATTERN = re.compile(r'^[0-9]{4}$')
+
+
+def video_extension_set(local):
+    """Function that returns the configured video extensions as a set.
+
+    Extensions are stored without the leading dot. Matching is case
+    sensitive as it always was ('MP4' has to be configured to be found)
+    unless local['video_extensions_ignore_case'] is set, then they are
+    stored lower case (see get_extension)
+    Input: local as local config dict
+    Output: frozenset of extensions
+    """
+    ignore_case = local['video_extensions_ignore_case']
+    return(frozenset(
+        ext.strip().lstrip('.').lower() if ignore_case else ext.strip().lstrip('.')
+        for ext in local['video_extensions']
+        if ext.strip() != ''))
+
+
+def get_extension(file_name, ignore_case=False):
+    """Function that returns the extension of a file name, without the dot,
+    lower case when ignore_case is True."""
+    extension = os.path.splitext(file_name)[1][1:]
+    return(extension.lower() if ignore_case else extension)
+
+
+def list_dir(folder_path):
+    """Function that lists a folder in one pass.
+
+    Uses scandir when available so that the file type comes from the
+    directory listing itself, files are stat'ed once.
+    Input: folder_path as string
+    Output: list of (name, is_dir, stat) tuples, stat is None for folders
+    """
+    entries = []
+    if(scandir is not None):
+        for entry in scandir(folder_path):
+            if(entry.is_dir()):
+                entries.append((entry.name, True, None))
+            elif(entry.is_file()):
+                entries.append((entry.name, False, entry.stat()))
+        return(entries)
+    for name in os.listdir(folder_path):
+        file_stat = os.stat(os.path.join(folder_path, name))
+        if(stat_module.S_ISDIR(file_stat.st_mode)):
+            entries.append((name, True, None))
+        elif(stat_module.S_ISREG(file_stat.st_mode)):
+            entries.append((name, False, file_stat))
+    return(entries)
+
+
+class LibrarySnapshot(object):
+    """Library snapshot.
+
+    Class that holds the result of one walk of the library so that every
+    step of a run can share it instead of walking the disk again
+    """
+
+    def __init__(self, root_dir):
+        """__init__."""
+        self.root_dir = root_dir
+        self.folders = []  # (folder_path, [(file_name, stat), ...])
+        self.mkvs = []  # (file_path, stat) of every mkv in event folders
+        self.long_versions = []  # mkvs named after their folder
+
+    def video_count(self):
+        """Return the number of videos found."""
+        return(sum(len(videos) for folder_path, videos in self.folders))
+
+    def forget(self, file_path):
+        """Remove a long version that is no longer in the library."""
+        self.mkvs = [mkv for mkv in self.mkvs if mkv[0] != file_path]
+        self.long_versions = [
+            long_version for long_version in self.long_versions
+            if long_version != file_path]
+
+
+def scan_folder(snapshot, folder_path, extensions, ignore_case=False):
+    """Function that adds the content of one event folder to a snapshot.
+
+    Input:  - snapshot as LibrarySnapshot
+            - folder_path as string
+            - extensions as set (see video_extension_set)
+            - ignore_case as Bool, local['video_extensions_ignore_case']
+    Output: None, changes snapshot in place
+    """
+    event = os.path.basename(folder_path)
+    videos = []
+    for file_name, is_dir, file_stat in sorted(list_dir(folder_path)):
+        if(is_dir):
+            continue
+        extension = get_extension(file_name, ignore_case)
+        if(extension in extensions):
+            videos.append((file_name, file_stat))
+        if(os.path.splitext(file_name)[1] == '.mkv'):
+            file_path = os.path.join(folder_path, file_name)
+            snapshot.mkvs.append((file_path, file_stat))
+            if(os.path.splitext(file_name)[0] == event):
+                snapshot.long_versions.append(file_path)
+    if(len(videos) != 0):
+        snapshot.folders.append((folder_path, videos))
+
+
+def list_event_folders(root_dir):
+    """Function that lists the event folders of the library.
+
+    Input: root_dir as string
+    Output: list of folder paths as strings
+    """
+    folder_paths = []
+    for year, is_dir, _ in sorted(list_dir(root_dir)):
+        if(not is_dir or not YEAR_PATTERN.match(year)):
+            continue
+        year_path = os.path.join(root_dir, year)
+        for event, is_dir, _ in sorted(list_dir(year_path)):
+            if(is_dir):
+                folder_paths.append(os.path.join(year_path, event))
+    return(folder_paths)
+
+
+def scan_library(local):
+    """Function that walks the library once.
+
+    Input: local as local config dict
+    Output: LibrarySnapshot
+    """
+    snapshot = scan_folders(local, list_event_folders(local['root_dir']))
+    logger.info('Library scanned: {} folders, {} videos, {} long versions'.format(
+        len(snapshot.folders),
+        snapshot.video_count(),
+        len(snapshot.long_versions)))
+    return(snapshot)
+
+
+def scan_folders(local, folder_paths):
+    """Function that walks only some event folders of the library.
+
+    Folders that do not exist anymore are skipped
+    Input: local as local config dict, folder_paths as list of strings
+    Output: LibrarySnapshot
+    """
+    extensions = video_extension_set(local)
+    snapshot = LibrarySnapshot(local['root_dir'])
+    for folder_path in folder_paths:
+        if(os.path.isdir(folder_path)):
+            scan_folder(snapshot, folder_path, extensions,
+                        local['video_extensions_ignore_case'])
+    return(snapshot)
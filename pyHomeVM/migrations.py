@@ -0,0 +1,220 @@
+# coding=utf-8
+"""Migrations.
+
+One shot migrations of the files pyHomeVM keeps between runs
+(video.db, structure.json, todo.sh) when their format changes
+"""
+import os
+import re
+import glob
+import json
+import codecs
+import shelve
+import logging
+import traceback
+from CONSTANTS import CONSTANTS
+from core import get_file_id, build_folder_id, createStructureEntry
+from core import convert_keys_to_string, write_structure
+from parallel import run_in_pool
+from caches import to_unicode
+from jobs import get_queue
+from videostore import VideoStore
+from structurestore import StructureStore
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+def read_file_id_version(CONSTANTS):
+    """Function that reads the version of the file IDs in use.
+
+    Input: CONSTANTS as dict
+    Output: version as int (1 when no version file exists)
+    """
+    if(not os.path.exists(CONSTANTS['file_id_version_path'])):
+        return(1)
+    with open(CONSTANTS['file_id_version_path'], 'r') as f:
+        return(int(f.read().strip()))
+
+
+def write_file_id_version(CONSTANTS):
+    """Function that records the version of the file IDs in use."""
+    with open(CONSTANTS['file_id_version_path'], 'w') as f:
+        f.write(str(CONSTANTS['file_id_version']))
+
+
+def migrate_file_ids(video_db, local, caches, CONSTANTS, store):
+    """Migrate file IDs.
+
+    Function that re-keys the video store and the structure with the current
+    file ID scheme so that an existing library is not seen as new
+    (and fully re-encoded) after the ID scheme changed.
+    Files that can not be found keep their old ID, the next run sees
+    their folder as modified as it would have anyway.
+    Input:  - video_db as VideoStore
+            - local as local config dict
+            - caches as dict of caches
+            - CONSTANTS as dict
+            - store as StructureStore
+    Output: None
+    """
+    if(read_file_id_version(CONSTANTS) == CONSTANTS['file_id_version']):
+        return
+    logger.info('Migrating file IDs to version {}'.format(CONSTANTS['file_id_version']))
+    past_structure = store.read()
+    old_paths = {}  # old file_id -> file path
+    for ID in past_structure:
+        folder_path = past_structure[ID]['path']
+        for file_id, file_name in past_structure[ID]['video_list'].items():
+            old_paths[file_id] = os.path.join(folder_path, file_name)
+    for file_id in video_db.keys():
+        if(file_id not in old_paths and video_db[file_id].category == 'long'):
+            old_paths[file_id] = video_db[file_id].file_path
+    old_ids = [
+        file_id for file_id in sorted(old_paths)
+        if os.path.isfile(to_unicode(old_paths[file_id]).encode('utf-8'))]
+    new_ids = run_in_pool(
+        lambda file_id: get_file_id(
+            to_unicode(old_paths[file_id]).encode('utf-8'), caches),
+        old_ids,
+        local['scan_workers'])
+    id_map = dict(zip(old_ids, new_ids))
+    with video_db.batch():
+        for old_id, new_id in id_map.items():
+            if(old_id not in video_db or old_id == new_id):
+                continue
+            video = video_db[old_id]
+            video.file_id = new_id
+            del(video_db[old_id])
+            video_db[new_id] = video
+    present_structure = {}
+    for ID in past_structure:
+        video_list = past_structure[ID]['video_list']
+        file_names = sorted(
+            file_name.encode('utf-8') for file_name in video_list.values())
+        names_to_ids = dict(
+            (file_name.encode('utf-8'), id_map.get(file_id, file_id))
+            for file_id, file_name in video_list.items())
+        new_ID, new_video_list = build_folder_id(
+            file_names,
+            [names_to_ids[file_name] for file_name in file_names])
+        createStructureEntry(
+            new_ID,
+            present_structure,
+            past_structure[ID]['path'],
+            new_video_list)
+    video_db.sync()
+    if(past_structure):
+        store.replace(present_structure)
+    write_file_id_version(CONSTANTS)
+    logger.info('{} file IDs migrated in {} folders'.format(
+        len(id_map), len(present_structure)))
+
+
+def migrate_todo_file(CONSTANTS):
+    """Migrate todo file.
+
+    Function that turns the remote moves left in todo.sh by an older
+    version into remote_move jobs of the job queue.
+    Input: CONSTANTS as dict
+    Output: None
+    """
+    if(not os.path.isfile(CONSTANTS['todo_file_path'])):
+        return
+    move_pattern = re.compile(r"^mv '(.*)' '(.*)'$")
+    with open(CONSTANTS['todo_file_path'], 'r') as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        match = move_pattern.match(line.strip())
+        if(match is None):
+            if(line.strip() != ''):
+                logger.info('Todo line not understood, dropped: {}'.format(line))
+            continue
+        get_queue().add(
+            'remote_move',
+            {'source': to_unicode(match.group(1)), 'destination': to_unicode(match.group(2))},
+            key='remote_move:' + to_unicode(match.group(1)))
+    os.remove(CONSTANTS['todo_file_path'])
+    logger.info('{} todo lines moved to the job queue'.format(len(lines)))
+
+
+def migrate_video_db(CONSTANTS):
+    """Migrate video db.
+
+    Function that copies the videos of the shelve video.db of an older
+    version into the SQLite video store, in one transaction. The copy is
+    made to a temporary file renamed to the video store once committed,
+    so an interrupted migration is done again on the next run. The
+    shelve files are kept, renamed with a .migrated suffix.
+    Input: CONSTANTS as dict
+    Output: VideoStore
+    """
+    store_path = CONSTANTS['video_store_path']
+    shelve_files = [
+        file_path for file_path in glob.glob(CONSTANTS['video_db_path'] + '*')
+        if not file_path.endswith('.migrated')]
+    if(len(shelve_files) == 0):
+        return(VideoStore(store_path))
+    if(os.path.exists(store_path)):
+        video_store = VideoStore(store_path)
+        if(len(video_store) != 0):
+            return(video_store)
+        video_store.close()  # Left empty by an interrupted migration
+        logger.info('{} is empty, migrating {} again'.format(
+            store_path, CONSTANTS['video_db_path']))
+        os.remove(store_path)
+    logger.info('Migrating {} to {}'.format(CONSTANTS['video_db_path'], store_path))
+    tmp_path = store_path + '.tmp'
+    if(os.path.exists(tmp_path)):
+        os.remove(tmp_path)
+    video_store = VideoStore(tmp_path)
+    video_db = shelve.open(CONSTANTS['video_db_path'], flag='r')
+    try:
+        with video_store.batch():
+            for file_id in video_db.keys():
+                video_store[file_id] = video_db[file_id]
+        count = len(video_store)
+    finally:
+        video_db.close()
+        video_store.close()
+    os.rename(tmp_path, store_path)
+    for file_path in shelve_files:
+        os.rename(file_path, file_path + '.migrated')
+    logger.info('{} videos migrated'.format(count))
+    return(VideoStore(store_path))
+
+
+def migrate_structure_file(CONSTANTS):
+    """Migrate structure file.
+
+    Function that rewrites the structure.json of an older version as
+    structure.jsonl, one folder per line, and hands its journal over to
+    the new file. structure.json is kept, renamed with a .migrated suffix.
+    An unreadable structure.json, cut by a crash, gives an empty
+    structure, as StructureStore.load_snapshot does.
+    Input: CONSTANTS as dict
+    Output: StructureStore
+    """
+    old_path = CONSTANTS['structure_file_path']
+    new_path = CONSTANTS['structure_store_path']
+    if(os.path.exists(new_path) or not os.path.exists(old_path)):
+        return(StructureStore(new_path))
+    logger.info('Migrating {} to {}'.format(old_path, new_path))
+    try:
+        with codecs.open(old_path, 'r', 'utf-8') as f:
+            structure = convert_keys_to_string(json.load(f))
+    except Exception:
+        logger.info(traceback.format_exc())
+        logger.info('{} is unreadable, starting from an empty structure'.format(old_path))
+        structure = {}
+    write_structure(structure, new_path)
+    if(os.path.exists(old_path + '.journal')):
+        os.rename(old_path + '.journal', new_path + '.journal')
+    os.rename(old_path, old_path + '.migrated')
+    logger.info('{} folders migrated'.format(len(structure)))
+    return(StructureStore(new_path))
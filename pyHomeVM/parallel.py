@@ -0,0 +1,62 @@
+# coding=utf-8
+"""Parallel.
+
+Helpers to run I/O bound work (hashing, probing, ffmpeg...) concurrently
+"""
+import logging
+from multiprocessing.pool import ThreadPool
+from CONSTANTS import CONSTANTS
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+def run_in_pool(func, items, workers):
+    """Function that applies func to every item with a bounded thread pool.
+
+    Results are returned in the same order as items, whatever the order
+    in which the workers finish. With 1 worker everything runs serially.
+    Input:  - func as function taking one item
+            - items as list
+            - workers as int
+    Output: list of results
+    """
+    items = list(items)
+    if(workers <= 1 or len(items) <= 1):
+        return([func(item) for item in items])
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return(pool.map(func, items))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_as_completed(func, items, workers):
+    """Function that applies func to every item with a bounded thread pool
+    and yields the results as the workers finish them.
+
+    The caller consumes the results in its own thread, so it can be the
+    only one writing them somewhere. With 1 worker everything runs serially.
+    Input:  - func as function taking one item
+            - items as list
+            - workers as int
+    Output: generator of (item, result)
+    """
+    items = list(items)
+    if(workers <= 1 or len(items) <= 1):
+        for item in items:
+            yield((item, func(item)))
+        return
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        for result in pool.imap_unordered(lambda item: (item, func(item)), items):
+            yield(result)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,162 @@
+# coding=utf-8
+"""Progress.
+
+Runs ffmpeg encodes with -progress and turns what it reports into per
+job metrics (frames, fps, speed, ETA, output size). Running jobs are
+logged regularly and written to a json status file, every finished job
+is summed up with its wall time and realtime factor.
+"""
+import time
+import logging
+import threading
+import subprocess
+from CONSTANTS import CONSTANTS
+from caches import write_json_atomic
+from commands import start_command, stop_command
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+LOG_INTERVAL = 30  # Seconds between two log lines of the same job
+STATUS_INTERVAL = 2  # Seconds between two writes of the status file
+
+jobs = {}  # job name -> metrics of the jobs of this run
+jobs_lock = threading.Lock()
+last_status_write = [0]
+
+
+def write_status(force=False):
+    """Function that writes the metrics of every job to the status file."""
+    with jobs_lock:
+        if(not force and time.time() - last_status_write[0] < STATUS_INTERVAL):
+            return
+        last_status_write[0] = time.time()
+        try:
+            write_json_atomic(
+                {'updated': time.time(), 'jobs': jobs},
+                CONSTANTS['progress_file_path'])
+        except (IOError, OSError):
+            logger.info('Progress status file could not be written')
+
+
+def parse_speed(speed):
+    """Function that reads the speed ffmpeg reports ('1.5x', 'N/A').
+
+    Output: speed as float, None if unknown
+    """
+    try:
+        return(float(speed.rstrip('x')))
+    except (AttributeError, ValueError):
+        return(None)
+
+
+def update_metrics(metrics, values, duration):
+    """Function that updates the metrics of a job with one -progress block.
+
+    Input:  - metrics as dict, changed in place
+            - values as dict of the key=value lines of the block
+            - duration as seconds of media to encode (None if unknown)
+    Output: None
+    """
+    fields = (
+        ('frames', 'frame', int),
+        ('fps', 'fps', float),
+        ('size', 'total_size', int),
+        ('position', 'out_time_ms', lambda value: int(value) / 1000000.0))
+    for metric, key, cast in fields:
+        try:
+            metrics[metric] = cast(values[key])
+        except (KeyError, ValueError):  # Not in this block or N/A
+            pass
+    if('speed' in values):
+        metrics['speed'] = parse_speed(values['speed'])
+    if(duration and metrics['speed']):
+        metrics['eta'] = max(0, (duration - metrics['position']) / metrics['speed'])
+    else:
+        metrics['eta'] = None
+
+
+def log_metrics(name, metrics):
+    """Function that logs the metrics of a running job."""
+    logger.info('[PROGRESS] {}: {} frames, {} fps, speed {}x, eta {}s, {} bytes'.format(
+        name,
+        metrics['frames'],
+        metrics['fps'],
+        metrics['speed'],
+        None if metrics['eta'] is None else int(metrics['eta']),
+        metrics['size']))
+
+
+def read_progress_line(line, values, metrics, name, duration):
+    """Function that reads one line of -progress output.
+
+    The metrics are updated, logged and written at the end of each block
+    Output: values of the block being read as dict
+    """
+    key, sep, value = line.decode('utf-8', 'replace').strip().partition('=')
+    if(not sep):
+        return(values)
+    values[key] = value
+    if(key != 'progress'):
+        return(values)
+    with jobs_lock:
+        update_metrics(metrics, values, duration)
+        log_due = time.time() - metrics['last_log'] >= LOG_INTERVAL
+        if(log_due):
+            metrics['last_log'] = time.time()
+    if(log_due):
+        log_metrics(name, metrics)
+    write_status()
+    return({})
+
+
+def execute_with_progress(command, name, duration=None):
+    """Execute with progress.
+
+    Function that runs an ffmpeg command with -progress on stdout and
+    follows its progress until it ends.
+    Input:  - command as string (ffmpeg command, without -progress)
+            - name as string, the job name in the logs and status file
+            - duration as seconds of media to encode (None if unknown)
+    Output: returncode of ffmpeg as int
+    """
+    command = command.replace(' -y ', ' -y -nostats -progress pipe:1 ', 1)
+    start = time.time()
+    metrics = {
+        'state': 'running', 'start': start, 'duration': duration,
+        'frames': 0, 'fps': 0.0, 'speed': None, 'eta': None,
+        'size': 0, 'position': 0.0, 'last_log': start}
+    with jobs_lock:
+        jobs[name] = metrics
+    proc = start_command(command, 'heavy', stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    values = {}
+    try:
+        for line in iter(proc.stdout.readline, b''):
+            values = read_progress_line(line, values, metrics, name, duration)
+    except BaseException:
+        stop_command(proc)
+        raise
+    returncode = proc.wait()
+    wall_time = time.time() - start
+    with jobs_lock:
+        metrics['state'] = 'done' if returncode == 0 else 'failed'
+        metrics['wall_time'] = wall_time
+        metrics['eta'] = None
+        if(returncode == 0 and duration and wall_time > 0):
+            metrics['realtime_factor'] = duration / wall_time
+        else:
+            metrics['realtime_factor'] = None
+    logger.info('[PROGRESS] {} {} in {:.1f}s, realtime factor {}, {} frames, {} bytes'.format(
+        name,
+        metrics['state'],
+        wall_time,
+        None if metrics['realtime_factor'] is None else round(metrics['realtime_factor'], 2),
+        metrics['frames'],
+        metrics['size']))
+    write_status(force=True)
+    return(returncode)
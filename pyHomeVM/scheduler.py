@@ -0,0 +1,64 @@
+# coding=utf-8
+"""Scheduler.
+
+Transcode scheduler: conversions run through a bounded number of ffmpeg
+processes shared by every caller, whatever folder they come from
+"""
+import logging
+import threading
+import traceback
+from CONSTANTS import CONSTANTS
+from parallel import run_in_pool
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+schedulers = {}
+schedulers_lock = threading.Lock()
+
+
+class TranscodeScheduler(object):
+    """Transcode scheduler.
+
+    Class that runs transcode jobs with at most `processes` of them at
+    once. The slots are shared between every run() call, so folders
+    processed at the same time share the same encode budget
+    """
+
+    def __init__(self, processes, threads):
+        """__init__."""
+        self.processes = processes
+        self.threads = threads
+        self.slots = threading.BoundedSemaphore(processes)
+
+    def run(self, func, items):
+        """Run func on every item and return the results in item order.
+
+        A job that raises is logged and its result is None
+        """
+        def run_job(item):
+            with self.slots:
+                try:
+                    return(func(item))
+                except Exception:
+                    logger.info(traceback.format_exc())
+                    return(None)
+        return(run_in_pool(run_job, items, self.processes))
+
+
+def get_scheduler(local):
+    """Function that returns the scheduler shared by the whole program.
+
+    Input: local as local config dict
+    Output: TranscodeScheduler
+    """
+    key = (local['transcode_processes'], local['transcode_threads'])
+    with schedulers_lock:
+        if(key not in schedulers):
+            schedulers[key] = TranscodeScheduler(*key)
+        return(schedulers[key])
@@ -0,0 +1,200 @@
+# coding=utf-8
+"""Segments.
+
+Split-encode-concat of long clips: the video stream is cut at keyframes
+into segments that are encoded in parallel, the audio is encoded once
+from the whole clip, then everything is joined without re-encoding.
+A single ffmpeg process can not use more than a few cores with the slow
+presets, the segments can.
+"""
+import os
+import re
+import shutil
+import logging
+import tempfile
+from CONSTANTS import CONSTANTS
+from commands import executeCommand
+from parallel import run_in_pool
+from progress import execute_with_progress
+from caches import to_unicode
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+THREADS_PATTERN = re.compile(r'-threads ([0-9]+)')
+
+
+def to_bytes(file_path):
+    """Function that returns a path as an utf-8 encoded string."""
+    return(to_unicode(file_path).encode('utf-8'))
+
+
+def segment_budget(local, video_options):
+    """Function that shares the threads of a transcode slot between segments.
+
+    A segmented encode runs inside one slot of the scheduler (or of
+    local['ffmpeg_processes']), whose ffmpeg gets the -threads of the
+    video options. The segments split these threads instead of each
+    taking as many, so the CPU budget holds whatever number of slots run.
+    Input:  - local as local config dict
+            - video_options as ffmpeg options with -threads
+    Output: (segments encoded at once, threads of each) as ints
+    """
+    match = THREADS_PATTERN.search(video_options)
+    threads = int(match.group(1)) if match else 1
+    workers = max(1, min(local['segment_workers'] or threads, threads))
+    return(workers, max(1, threads // workers))
+
+
+def use_segments(local, duration, video_options):
+    """Function that tells if a clip is long enough to be encoded in segments,
+    and if its slot has the threads for more than one segment at once.
+
+    Input:  - local as local config dict
+            - duration as seconds (None if unknown)
+            - video_options as ffmpeg options with -threads
+    Output: Bool
+    """
+    return(local['segment_encoding'] and
+           segment_budget(local, video_options)[0] > 1 and
+           duration is not None and
+           duration >= local['segment_min_minutes'] * 60)
+
+
+def split_video(local, input_file, segment_folder, segment_time):
+    """Function that cuts the video stream of a clip at keyframes.
+
+    Input:  - local as local config dict
+            - input_file, segment_folder as strings
+            - segment_time as seconds between cuts
+    Output: list of segment paths, in order
+    """
+    command = (
+        "'{}' -loglevel panic -y -i '{}' "
+        "-map 0:v:0 -an -c copy -f segment -segment_time {} "
+        "-reset_timestamps 1 '{}'").format(
+        local['ffmpeg_executable_path'],
+        input_file,
+        segment_time,
+        os.path.join(segment_folder, 'part%04d.mkv'))
+    executeCommand(command, 'heavy')
+    return(sorted(
+        os.path.join(segment_folder, name)
+        for name in os.listdir(segment_folder)
+        if name.startswith('part')))
+
+
+def encode_segment(local, segment, video_options):
+    """Function that encodes one video segment.
+
+    Output: path of the encoded segment, None if ffmpeg failed
+    """
+    output_file = os.path.join(
+        os.path.dirname(segment),
+        os.path.basename(segment).replace('part', 'encoded', 1))
+    command = "'{}' -loglevel panic -y -i '{}' {} -an '{}'".format(
+        local['ffmpeg_executable_path'],
+        segment,
+        video_options,
+        output_file)
+    execute_with_progress(command, output_file)
+    if(not os.path.isfile(output_file)):
+        return(None)
+    return(output_file)
+
+
+def encode_audio(local, input_file, segment_folder, audio_options):
+    """Function that encodes the audio of a whole clip.
+
+    Output: path of the encoded audio, None if ffmpeg failed
+    """
+    output_file = os.path.join(segment_folder, 'audio.mkv')
+    command = "'{}' -loglevel panic -y -i '{}' -vn {} '{}'".format(
+        local['ffmpeg_executable_path'],
+        input_file,
+        audio_options,
+        output_file)
+    executeCommand(command, 'heavy')
+    if(not os.path.isfile(output_file)):
+        return(None)
+    return(output_file)
+
+
+def join_segments(local, encoded, audio, segment_folder, output_file, output_options):
+    """Function that concatenates the encoded segments and adds the audio.
+
+    Streams are copied, nothing is encoded again
+    """
+    list_file = os.path.join(segment_folder, 'segments.txt')
+    with open(list_file, 'w') as f:
+        for segment in encoded:
+            f.write("file '{}'\n".format(segment))
+    if(audio is not None):
+        audio_input = "-i '{}' -map 0:v -map 1:a".format(audio)
+    else:
+        audio_input = '-map 0:v'
+    command = (
+        "'{}' -loglevel panic -y -f concat -safe 0 -i '{}' {} "
+        "-c copy {} '{}'").format(
+        local['ffmpeg_executable_path'],
+        list_file,
+        audio_input,
+        output_options,
+        output_file)
+    executeCommand(command, 'heavy')
+
+
+def encode_in_segments(local, input_file, output_file, duration, has_audio,
+                       video_options, audio_options, output_options):
+    """Encode in segments.
+
+    Function that encodes a clip in segments, as many at once as the
+    threads of its slot allow (see segment_budget). The segments are cut on keyframes with their timestamps reset
+    and joined by the concat demuxer, so the output has the duration and
+    start time of a single pass encode and the chapters built from it
+    stay accurate.
+    Input:  - local as local config dict
+            - input_file, output_file as strings
+            - duration as seconds
+            - has_audio as Bool
+            - video_options as ffmpeg options of the video stream
+            - audio_options as ffmpeg options of the audio stream
+            - output_options as ffmpeg options of the output (metadata...)
+    Output: Bool, False when the caller has to encode the clip in one pass
+    """
+    input_file = to_bytes(input_file)
+    output_file = to_bytes(output_file)
+    segment_folder = tempfile.mkdtemp(
+        prefix='.segments_', dir=os.path.dirname(output_file))
+    try:
+        workers, threads = segment_budget(local, video_options)
+        video_options = THREADS_PATTERN.sub('-threads {}'.format(threads), video_options)
+        segments = split_video(
+            local, input_file, segment_folder, int(duration // workers) + 1)
+        if(len(segments) == 0):
+            logger.info('[SEGMENTS] {} could not be split'.format(input_file))
+            return(False)
+        logger.info('[SEGMENTS] {} split in {} segments'.format(input_file, len(segments)))
+        jobs = [('video', segment) for segment in segments]
+        if(has_audio):
+            jobs.insert(0, ('audio', None))
+        results = run_in_pool(
+            lambda job: (
+                encode_audio(local, input_file, segment_folder, audio_options)
+                if job[0] == 'audio'
+                else encode_segment(local, job[1], video_options)),
+            jobs,
+            workers)
+        audio = results.pop(0) if has_audio else None
+        if(None in results or (has_audio and audio is None)):
+            logger.info('[SEGMENTS] {}: a segment failed to encode'.format(input_file))
+            return(False)
+        join_segments(local, results, audio, segment_folder, output_file, output_options)
+        return(os.path.isfile(output_file))
+    finally:
+        shutil.rmtree(segment_folder, ignore_errors=True)
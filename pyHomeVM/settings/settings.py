@@ -1,6 +1,7 @@
 import logging
 import os
 import ConfigParser
+import multiprocessing
 import traceback
 from .. import CONSTANTS
 
@@ -12,6 +13,41 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
+def get_optional(config, section, option, default):
+    """
+    Function that reads an optional option of the config file.
+    The option is parsed with the type of its default value
+    Input: config, section as string, option as string, default value
+    Output: value of the option or default if missing or empty
+    """
+    if(not config.has_option(section, option) or
+            config.get(section, option).strip() == ''):
+        return(default)
+    if(isinstance(default, bool)):
+        return(config.getboolean(section, option))
+    if(isinstance(default, int)):
+        return(config.getint(section, option))
+    if(isinstance(default, float)):
+        return(config.getfloat(section, option))
+    return(config.get(section, option))
+
+
+def ffmpeg_slots(max_processes, threads, cpu_budget):
+    """
+    Function that decides how many ffmpeg processes can run at once and
+    how many threads each one gets, so that processes x threads stays
+    within the cpu budget.
+    Input: max_processes, threads (0 to share the budget), cpu_budget as int
+    Output: (processes, threads) as ints
+    """
+    cpu_budget = max(1, cpu_budget)
+    max_processes = max(1, max_processes)
+    if(threads <= 0):
+        threads = max(1, cpu_budget // max_processes)
+    processes = max(1, min(max_processes, cpu_budget // threads))
+    return(processes, threads)
+
+
 def load_core(config):
     logger.info('Local and ffmpeg loading')
     ffmpeg = {}
@@ -28,9 +64,35 @@ def load_core(config):
         ffprobe_executable_path = config.get('LOCAL', 'ffprobe_executable_path')
         ffmpeg_executable_path = config.get('LOCAL', 'ffmpeg_executable_path')
         video_extensions = config.get('LOCAL', 'video_extensions').split(',')
+        video_extensions_ignore_case = get_optional(
+            config, 'LOCAL', 'video_extensions_ignore_case', False)
         root_dir = config.get('LOCAL', 'root_dir')
         log_folder = config.get('LOCAL', 'log_folder')
         mkvmerge_executable_path = config.get('LOCAL', 'mkvmerge_executable_path')
+        scan_workers = get_optional(config, 'LOCAL', 'scan_workers', 1)
+        probe_workers = get_optional(config, 'LOCAL', 'probe_workers', 4)
+        integrity_mode = get_optional(config, 'LOCAL', 'integrity_mode', 'tiered')
+        integrity_samples = get_optional(config, 'LOCAL', 'integrity_samples', 5)
+        integrity_sample_seconds = get_optional(
+            config, 'LOCAL', 'integrity_sample_seconds', 2)
+        max_ffmpeg_processes = get_optional(config, 'LOCAL', 'max_ffmpeg_processes', 1)
+        ffmpeg_threads = get_optional(config, 'LOCAL', 'ffmpeg_threads', 0)
+        cpu_budget = get_optional(
+            config, 'LOCAL', 'cpu_budget', multiprocessing.cpu_count())
+        transcode_processes = get_optional(
+            config, 'LOCAL', 'transcode_processes', max_ffmpeg_processes)
+        transcode_threads = get_optional(config, 'LOCAL', 'transcode_threads', ffmpeg_threads)
+        conversion_cache_dir = get_optional(
+            config, 'LOCAL', 'conversion_cache_dir', CONSTANTS.CONSTANTS['conversion_cache_dir'])
+        conversion_cache_max_gb = get_optional(
+            config, 'LOCAL', 'conversion_cache_max_gb', 20.0)
+        segment_encoding = get_optional(config, 'LOCAL', 'segment_encoding', False)
+        segment_min_minutes = get_optional(config, 'LOCAL', 'segment_min_minutes', 30)
+        segment_workers = get_optional(config, 'LOCAL', 'segment_workers', 0)
+        transfer_workers = get_optional(config, 'LOCAL', 'transfer_workers', 2)
+        folder_workers = get_optional(config, 'LOCAL', 'folder_workers', 1)
+        watch_interval = get_optional(config, 'LOCAL', 'watch_interval', 30)
+        watch_settle = get_optional(config, 'LOCAL', 'watch_settle', 60)
         logger.info('LOCAL config loaded')
     except Exception:
         logger.info(traceback.format_exc())
@@ -44,13 +106,58 @@ def load_core(config):
     local['ffmpeg_executable_path'] = ffmpeg_executable_path
     local['ffprobe_executable_path'] = ffprobe_executable_path
     local['video_extensions'] = video_extensions
+    local['video_extensions_ignore_case'] = video_extensions_ignore_case
+    if(video_extensions_ignore_case):
+        logger.info('Video extensions matched ignoring case, folders with clips '
+                    'in other cases (.MP4...) are new or modified on the next run')
     local['root_dir'] = root_dir
     local['log_folder'] = log_folder
     local['mkvmerge_executable_path'] = mkvmerge_executable_path
+    local['scan_workers'] = max(1, scan_workers)
+    local['probe_workers'] = max(1, probe_workers)
+    local['integrity_mode'] = integrity_mode
+    local['integrity_samples'] = max(1, integrity_samples)
+    local['integrity_sample_seconds'] = max(1, integrity_sample_seconds)
+    (local['ffmpeg_processes'], local['ffmpeg_threads']) = ffmpeg_slots(
+        max_ffmpeg_processes, ffmpeg_threads, cpu_budget)
+    (local['transcode_processes'], local['transcode_threads']) = ffmpeg_slots(
+        transcode_processes, transcode_threads, cpu_budget)
+    local['conversion_cache_dir'] = conversion_cache_dir
+    local['conversion_cache_max_size'] = int(conversion_cache_max_gb * 1024 ** 3)
+    local['segment_encoding'] = segment_encoding
+    local['segment_min_minutes'] = segment_min_minutes
+    local['segment_workers'] = max(0, segment_workers)  # 0: as many as the slot has threads
+    local['transfer_workers'] = max(1, transfer_workers)
+    local['folder_workers'] = max(1, folder_workers)
+    local['watch_interval'] = watch_interval
+    local['watch_settle'] = watch_settle
     logger.info('ffmpeg and local loaded')
     return(ffmpeg, local)
 
 
+def load_resources(config):
+    """
+    Function that reads the optional RESOURCES section: the limits of the
+    heavy commands (encodes, decodes, merges) and of the light ones
+    (probes...). Every option is optional, no limit by default.
+    Input: config
+    Output: resources as dict of profile name -> profile dict
+    """
+    logger.info('Resources loading')
+    resources = {}
+    for name in ('light', 'heavy'):
+        resources[name] = {
+            'nice': get_optional(config, 'RESOURCES', name + '_nice', 0),
+            'ionice_class': get_optional(config, 'RESOURCES', name + '_ionice_class', 0),
+            'ionice_level': get_optional(config, 'RESOURCES', name + '_ionice_level', 4),
+            'threads': get_optional(config, 'RESOURCES', name + '_threads', 0),
+            'windows': get_optional(config, 'RESOURCES', name + '_windows', ''),
+            'outside_windows': get_optional(
+                config, 'RESOURCES', name + '_outside_windows', 'pause')}
+    logger.info('Resources loaded')
+    return(resources)
+
+
 def load_remote(config):
     logger.info('Remote loading')
     remote = {}
@@ -182,9 +289,45 @@ composer_name:
 ffmpeg_executable_path:
 ffprobe_executable_path:
 video_extensions:
+# True also finds clips whose extension case differs from the list (.MP4).
+# The first run with it re-processes every folder holding such clips.
+video_extensions_ignore_case: False
 mkvmerge_executable_path:
 root_dir:
 log_folder:
+scan_workers: 1
+probe_workers: 4
+integrity_mode: tiered
+integrity_samples: 5
+integrity_sample_seconds: 2
+max_ffmpeg_processes: 1
+ffmpeg_threads: 0
+cpu_budget:
+transcode_processes:
+transcode_threads:
+conversion_cache_dir:
+conversion_cache_max_gb: 20
+segment_encoding: False
+segment_min_minutes: 30
+segment_workers:
+transfer_workers: 2
+folder_workers: 1
+watch_interval: 30
+watch_settle: 60
+
+[RESOURCES]
+# nice: 0-19, ionice_class: 1 realtime, 2 best-effort, 3 idle (0: unchanged),
+# threads: max threads per ffmpeg (0: unchanged),
+# windows: allowed times of day as 01:00-07:00,22:00-23:59 (empty: always),
+# outside_windows: pause (stop running commands) or wait (only delay new ones)
+heavy_nice: 10
+heavy_ionice_class: 2
+heavy_ionice_level: 7
+heavy_threads: 0
+heavy_windows:
+heavy_outside_windows: pause
+light_nice: 0
+light_ionice_class: 0
 
 [REMOTE]
 ip_addr:
@@ -0,0 +1,148 @@
+# coding=utf-8
+"""Structure diff.
+
+Compares the structure of the last run with the one read from the
+library scan and returns what changed, folder by folder. Folders are
+matched by ID then by path through two indexes, so the diff is linear
+in the number of folders and never goes back to the disk: the file
+lists come from the structures themselves.
+"""
+import logging
+from CONSTANTS import CONSTANTS
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+NEW = 'new'
+MOVED = 'moved'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+
+
+class Change(object):
+    """Change.
+
+    Class that describes what happened to one folder:
+        - new: new_ID, path
+        - moved: ID, old_path, path
+        - modified: ID (old ID), new_ID, path, added and removed file names
+        - deleted: ID, old_path
+    """
+
+    __slots__ = ('kind', 'ID', 'new_ID', 'old_path', 'path', 'added', 'removed')
+
+    def __init__(self, kind, ID=None, new_ID=None, old_path=None, path=None,
+                 added=(), removed=()):
+        """__init__."""
+        self.kind = kind
+        self.ID = ID
+        self.new_ID = new_ID
+        self.old_path = old_path
+        self.path = path
+        self.added = list(added)
+        self.removed = list(removed)
+
+    def __repr__(self):
+        return('Change({}, {})'.format(
+            self.kind, (self.path or self.old_path).encode('utf-8')))
+
+
+class ChangeSet(object):
+    """Change set.
+
+    Class that holds the changes between two structures, by kind
+    """
+
+    def __init__(self):
+        """__init__."""
+        self.new = []
+        self.moved = []
+        self.modified = []
+        self.deleted = []
+
+    def add(self, change):
+        """Add a change to the list of its kind."""
+        getattr(self, change.kind).append(change)
+
+    def __iter__(self):
+        """Iterate over moved, modified, deleted then new folders."""
+        for kind in (MOVED, MODIFIED, DELETED, NEW):
+            for change in getattr(self, kind):
+                yield change
+
+    def __len__(self):
+        return(len(self.new) + len(self.moved) + len(self.modified) + len(self.deleted))
+
+    def summary(self):
+        """Return the number of changes of each kind as string."""
+        return('{} new, {} moved, {} modified, {} deleted'.format(
+            len(self.new), len(self.moved), len(self.modified), len(self.deleted)))
+
+
+def index_paths(structure):
+    """
+    Function that indexes a structure by folder path
+    Input: structure as dict
+    Output: dict of path -> ID
+    """
+    return(dict((entry['path'], ID) for ID, entry in structure.items()))
+
+
+def diff_files(past_entry, new_entry):
+    """
+    Function that compares the video lists of two entries of one folder
+    Input: past_entry, new_entry as structure entries
+    Output: added file names as list, removed file names as list
+    """
+    past_files = set(past_entry['video_list'].values())
+    new_files = set(new_entry['video_list'].values())
+    return(sorted(new_files - past_files), sorted(past_files - new_files))
+
+
+def diff_structures(past_structure, new_structure):
+    """
+    Function that compares two structures.
+    A folder ID found in both is unchanged or moved, a past ID missing
+    from the new structure is modified when its path is still there and
+    deleted otherwise. New IDs that were not matched are new folders.
+    Input: past_structure as dict, new_structure as dict
+    Output: ChangeSet
+    """
+    changes = ChangeSet()
+    new_paths = index_paths(new_structure)
+    matched = set()  # New IDs already explained by a past folder
+    for ID, past_entry in past_structure.items():
+        if(ID == ''):  # Empty folder
+            continue
+        if(ID in new_structure):
+            matched.add(ID)
+            if(past_entry['path'] != new_structure[ID]['path']):
+                changes.add(Change(
+                    MOVED,
+                    ID=ID,
+                    old_path=past_entry['path'],
+                    path=new_structure[ID]['path']))
+        elif(past_entry['path'] in new_paths):
+            new_ID = new_paths[past_entry['path']]
+            matched.add(new_ID)
+            added, removed = diff_files(past_entry, new_structure[new_ID])
+            changes.add(Change(
+                MODIFIED,
+                ID=ID,
+                new_ID=new_ID,
+                path=past_entry['path'],
+                added=added,
+                removed=removed))
+        else:
+            changes.add(Change(DELETED, ID=ID, old_path=past_entry['path']))
+    for new_ID, new_entry in new_structure.items():
+        if(new_ID in matched):
+            continue
+        changes.add(Change(NEW, new_ID=new_ID, path=new_entry['path']))
+    logger.info('Structure diff: {}'.format(changes.summary()))
+    return(changes)
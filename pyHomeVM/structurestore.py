@@ -0,0 +1,149 @@
+# coding=utf-8
+"""Structure store.
+
+The structure (folder ID -> path and videos) is kept in structure.jsonl,
+one folder per line (see write_structure), plus an append-only journal
+of the changes made since structure.jsonl was written. Every change is
+one fsync'd json line, so a crash loses at most the folder being
+processed. The journal is folded back into structure.jsonl (compaction)
+when it grows and at the end of a run. Both files are streamed line by
+line: the structure in memory is the only copy ever built.
+"""
+import os
+import json
+import codecs
+import logging
+import traceback
+from CONSTANTS import CONSTANTS
+from core import convert_keys_to_string, iter_structure, write_structure
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+COMPACT_EVERY = 500  # Journal records before structure.jsonl is rewritten
+
+
+class StructureStore(object):
+    """Structure store.
+
+    Class that holds the structure in memory and records every change
+    to it in the journal. Records are:
+        - new: {'op', 'id', 'entry'}
+        - moved: {'op', 'id', 'path'}
+        - modified: {'op', 'id' (old ID), 'new_id', 'entry'}
+        - deleted: {'op', 'id'}
+    """
+
+    def __init__(self, file_path):
+        """__init__."""
+        self.file_path = file_path
+        self.journal_path = file_path + '.journal'
+        self.structure = self.load_snapshot()
+        self.journal_size = self.replay()
+        self.journal = open(self.journal_path, 'a')
+
+    def load_snapshot(self):
+        """Read structure.jsonl, empty structure if missing or unreadable."""
+        if(not os.path.exists(self.file_path)):
+            logger.info('{} not found'.format(self.file_path))
+            return({})
+        try:
+            return(dict(iter_structure(self.file_path)))
+        except Exception:
+            logger.info(traceback.format_exc())
+            return({})
+
+    def replay(self):
+        """Apply the journal left by the last run.
+
+        A last line cut by a crash is ignored
+        Output: number of records applied
+        """
+        if(not os.path.exists(self.journal_path)):
+            return(0)
+        applied = 0
+        with codecs.open(self.journal_path, 'r', 'utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.info('Incomplete journal record ignored')
+                    break
+                record = convert_keys_to_string(record)
+                record['id'] = str(record['id'])  # IDs are hex digests
+                if(record['op'] == 'modified'):
+                    record['new_id'] = str(record['new_id'])
+                self.apply(record)
+                applied += 1
+        if(applied != 0):
+            logger.info('{} structure changes replayed from the journal'.format(applied))
+        return(applied)
+
+    def apply(self, record):
+        """Apply one record to the structure in memory."""
+        if(record['op'] == 'new'):
+            self.structure[record['id']] = record['entry']
+        elif(record['op'] == 'moved'):
+            if(record['id'] not in self.structure):  # Replayed after a compaction
+                return
+            self.structure[record['id']] = {
+                'path': record['path'],
+                'video_list': self.structure[record['id']]['video_list']}
+        elif(record['op'] == 'modified'):
+            self.structure.pop(record['id'], None)
+            if(record['entry'] is not None):
+                self.structure[record['new_id']] = record['entry']
+        elif(record['op'] == 'deleted'):
+            self.structure.pop(record['id'], None)
+
+    def record(self, record):
+        """Write a record to the journal, fsync it, then apply it."""
+        self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.apply(record)
+        self.journal_size += 1
+        if(self.journal_size >= COMPACT_EVERY):
+            self.compact()
+
+    def new(self, ID, entry):
+        """Record a new folder."""
+        self.record({'op': 'new', 'id': ID, 'entry': entry})
+
+    def moved(self, ID, path):
+        """Record a folder that moved."""
+        self.record({'op': 'moved', 'id': ID, 'path': path})
+
+    def modified(self, ID, new_ID, entry):
+        """Record a modified folder, entry is None if it was left out."""
+        self.record({'op': 'modified', 'id': ID, 'new_id': new_ID, 'entry': entry})
+
+    def deleted(self, ID):
+        """Record a deleted folder."""
+        self.record({'op': 'deleted', 'id': ID})
+
+    def read(self):
+        """Return a copy of the structure, safe to iterate while recording."""
+        return(dict(self.structure))
+
+    def replace(self, structure):
+        """Replace the whole structure (migrations)."""
+        self.structure = dict(structure)
+        self.compact()
+
+    def compact(self):
+        """Write structure.jsonl and empty the journal."""
+        write_structure(self.structure, self.file_path)
+        self.journal.close()
+        self.journal = open(self.journal_path, 'w')
+        self.journal_size = 0
+
+    def close(self):
+        """Compact and close the journal."""
+        self.compact()
+        self.journal.close()
@@ -0,0 +1,189 @@
+# coding=utf-8
+"""Transfer.
+
+Copies long versions to the remote media player in chunks, to a .part
+file next to the destination. A copy cut by a sleeping media player or
+a dropped link resumes from the last whole chunk that still matches the
+source. The .part file is renamed to the destination once the copy is
+verified, and only then is the local file removed. Throughput is logged
+and written to the progress status file.
+"""
+import os
+import time
+import logging
+from CONSTANTS import CONSTANTS
+from progress import jobs, jobs_lock, write_status, LOG_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+CHUNK_SIZE = 8 * 1024 ** 2  # Bytes copied per read/write
+VERIFY_SIZE = 1024 ** 2  # Bytes compared by every verification window
+VERIFY_SAMPLES = 8  # Windows compared over a finished copy, ends included
+
+
+def same_bytes(source, destination, offset, size):
+    """
+    Function that compares a window of two open files
+    Input: source, destination as files opened in binary mode,
+           offset and size as ints
+    Output: Bool
+    """
+    source.seek(offset)
+    destination.seek(offset)
+    return(source.read(size) == destination.read(size))
+
+
+def resume_offset(source_path, part_path):
+    """
+    Function that finds where an interrupted copy can resume. Only whole
+    chunks are kept, and the last one has to match the source, otherwise
+    the copy starts over.
+    Input: source_path, part_path as strings
+    Output: offset as int
+    """
+    if(not os.path.exists(part_path)):
+        return(0)
+    part_size = os.path.getsize(part_path)
+    if(part_size > os.path.getsize(source_path)):
+        return(0)
+    offset = (part_size // CHUNK_SIZE) * CHUNK_SIZE
+    if(offset == 0):
+        return(0)
+    window = min(VERIFY_SIZE, offset)
+    with open(source_path, 'rb') as source:
+        with open(part_path, 'rb') as part:
+            if(not same_bytes(source, part, offset - window, window)):
+                logger.info('[TRANSFER] {} does not match its source, starting over'.format(
+                    part_path))
+                return(0)
+    return(offset)
+
+
+def verify_copy(source_path, destination_path):
+    """
+    Function that checks a copy: same size and VERIFY_SAMPLES windows,
+    spread from the start to the end of the file, identical. Reading the
+    whole copy back would double the traffic to the media player.
+    Input: source_path, destination_path as strings
+    Output: Bool
+    """
+    size = os.path.getsize(source_path)
+    if(os.path.getsize(destination_path) != size):
+        return(False)
+    window = min(VERIFY_SIZE, size)
+    last = size - window
+    offsets = sorted(set(
+        last * n // (VERIFY_SAMPLES - 1) for n in range(VERIFY_SAMPLES)))
+    with open(source_path, 'rb') as source:
+        with open(destination_path, 'rb') as destination:
+            for offset in offsets:
+                if(not same_bytes(source, destination, offset, window)):
+                    return(False)
+    return(True)
+
+
+def log_throughput(name, metrics):
+    """Function that logs the progress of a running transfer."""
+    logger.info('[TRANSFER] {}: {} / {} bytes, {:.1f} MB/s, eta {}s'.format(
+        name,
+        metrics['position'],
+        metrics['size'],
+        metrics['throughput'] / 1024 ** 2,
+        None if metrics['eta'] is None else int(metrics['eta'])))
+
+
+def copy_chunks(source_path, part_path, offset, name):
+    """
+    Function that copies a file from an offset in CHUNK_SIZE chunks,
+    updating the transfer metrics
+    Input: source_path, part_path as strings, offset as int,
+           name as string, the job name in the logs and status file
+    Output: metrics as dict
+    """
+    start = time.time()
+    metrics = {
+        'state': 'running', 'start': start, 'size': os.path.getsize(source_path),
+        'resumed_at': offset, 'position': offset, 'throughput': 0.0, 'eta': None,
+        'last_log': start}
+    with jobs_lock:
+        jobs[name] = metrics
+    with open(source_path, 'rb') as source:
+        with open(part_path, 'r+b' if offset else 'wb') as part:
+            part.truncate(offset)
+            source.seek(offset)
+            part.seek(offset)
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if(not chunk):
+                    break
+                part.write(chunk)
+                with jobs_lock:
+                    metrics['position'] += len(chunk)
+                    elapsed = max(time.time() - start, 0.001)
+                    metrics['throughput'] = (metrics['position'] - offset) / elapsed
+                    metrics['eta'] = (
+                        (metrics['size'] - metrics['position']) / metrics['throughput'])
+                    log_due = time.time() - metrics['last_log'] >= LOG_INTERVAL
+                    if(log_due):
+                        metrics['last_log'] = time.time()
+                if(log_due):
+                    log_throughput(name, metrics)
+                write_status()
+            part.flush()
+            os.fsync(part.fileno())
+    metrics['wall_time'] = time.time() - start
+    return(metrics)
+
+
+def transfer_file(source_path, destination_path):
+    """Transfer file.
+
+    Function that moves a file to the remote media player through a
+    .part file, resuming a copy left by an earlier attempt. The source
+    is removed once the destination is verified.
+    Input: source_path, destination_path as strings
+    Output: Bool, True when the file is at its destination
+    """
+    part_path = destination_path + '.part'
+    name = os.path.basename(destination_path)
+    if(os.path.exists(destination_path) and  # Renamed, source not removed yet
+            verify_copy(source_path, destination_path)):
+        os.remove(source_path)
+        logger.info('[TRANSFER] {} already transferred'.format(destination_path))
+        return(True)
+    offset = resume_offset(source_path, part_path)
+    if(offset != 0):
+        logger.info('[TRANSFER] {} resumed at {} bytes'.format(destination_path, offset))
+    try:
+        metrics = copy_chunks(source_path, part_path, offset, name)
+    except (IOError, OSError):
+        with jobs_lock:
+            if(name in jobs):
+                jobs[name]['state'] = 'failed'
+        write_status(force=True)
+        raise
+    verified = verify_copy(source_path, part_path)
+    with jobs_lock:
+        metrics['state'] = 'done' if verified else 'failed'
+        metrics['eta'] = None
+    write_status(force=True)
+    if(not verified):
+        logger.info('[TRANSFER] {} differs from its source, removed'.format(part_path))
+        os.remove(part_path)
+        return(False)
+    if(os.path.exists(destination_path)):  # Older long version, CIFS does not replace
+        os.remove(destination_path)
+    os.rename(part_path, destination_path)
+    os.remove(source_path)
+    logger.info('[TRANSFER] {} transferred in {:.1f}s, {:.1f} MB/s ({} bytes resumed)'.format(
+        destination_path,
+        metrics['wall_time'],
+        metrics['throughput'] / 1024 ** 2,
+        metrics['resumed_at']))
+    return(True)
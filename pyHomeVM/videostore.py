@@ -0,0 +1,173 @@
+# coding=utf-8
+"""Video store.
+
+SQLite store of the Video objects, keyed by file ID. It has the mapping
+interface the rest of the code used with shelve (get, set, del, in,
+iteration, keys) and keeps the path, folder and category of every video
+in indexed columns so they can be queried without loading every object.
+"""
+import os
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from CONSTANTS import CONSTANTS
+from caches import to_unicode
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS videos ('
+    'file_id TEXT PRIMARY KEY, '
+    'file_path TEXT, '
+    'folder TEXT, '
+    'category TEXT, '
+    'data BLOB)',
+    'CREATE INDEX IF NOT EXISTS videos_file_path ON videos (file_path)',
+    'CREATE INDEX IF NOT EXISTS videos_folder ON videos (folder)',
+    'CREATE INDEX IF NOT EXISTS videos_category ON videos (category)')
+
+
+class VideoStore(object):
+    """Video store.
+
+    Class that stores Video objects in SQLite. Every write is committed
+    at once, unless it happens inside batch(), which commits all of its
+    writes in one transaction. Objects read from the store are copies:
+    a changed Video has to be assigned back to be saved.
+    """
+
+    def __init__(self, file_path):
+        """__init__."""
+        self.file_path = file_path
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.batch_depth = 0
+        with self.lock:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            self.connection.commit()
+
+    def commit(self):
+        """Commit the pending writes, unless a batch is running."""
+        if(self.batch_depth == 0):
+            self.connection.commit()
+
+    @contextmanager
+    def batch(self):
+        """Group the writes of a block in one transaction."""
+        with self.lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.batch_depth -= 1
+                if(self.batch_depth == 0):
+                    self.connection.rollback()
+                raise
+            self.batch_depth -= 1
+            self.commit()
+
+    def __getitem__(self, file_id):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT data FROM videos WHERE file_id = ?',
+                (to_unicode(file_id),)).fetchone()
+        if(row is None):
+            raise KeyError(file_id)
+        return(pickle.loads(bytes(row[0])))
+
+    def __setitem__(self, file_id, video):
+        file_path = to_unicode(video.file_path)
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO videos '
+                '(file_id, file_path, folder, category, data) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (to_unicode(file_id),
+                 file_path,
+                 os.path.dirname(file_path),
+                 video.category,
+                 sqlite3.Binary(pickle.dumps(video, 2))))
+            self.commit()
+
+    def __delitem__(self, file_id):
+        with self.lock:
+            cursor = self.connection.execute(
+                'DELETE FROM videos WHERE file_id = ?', (to_unicode(file_id),))
+            self.commit()
+        if(cursor.rowcount == 0):
+            raise KeyError(file_id)
+
+    def __contains__(self, file_id):
+        with self.lock:
+            return(self.connection.execute(
+                'SELECT 1 FROM videos WHERE file_id = ?',
+                (to_unicode(file_id),)).fetchone() is not None)
+
+    def __len__(self):
+        with self.lock:
+            return(self.connection.execute('SELECT COUNT(*) FROM videos').fetchone()[0])
+
+    def __iter__(self):
+        """Iterate over a snapshot of the keys, the store can change meanwhile."""
+        return(iter(self.keys()))
+
+    def keys(self):
+        """Return every file ID as a list of strings."""
+        with self.lock:
+            return([
+                str(row[0]) for row in
+                self.connection.execute('SELECT file_id FROM videos')])
+
+    def get(self, file_id, default=None):
+        """Return the Video of a file ID or default."""
+        try:
+            return(self[file_id])
+        except KeyError:
+            return(default)
+
+    def select(self, column, value):
+        """Return the file IDs of the videos with a value in an indexed column."""
+        if(column not in ('file_path', 'folder', 'category')):
+            raise ValueError(column)
+        with self.lock:
+            return([
+                str(row[0]) for row in self.connection.execute(
+                    'SELECT file_id FROM videos WHERE {} = ?'.format(column),
+                    (to_unicode(value),))])
+
+    def delete_categories_except(self, categories):
+        """Delete the videos whose category is not in categories, in SQL.
+
+        Output: number of videos deleted
+        """
+        categories = list(categories)
+        with self.lock:
+            cursor = self.connection.execute(
+                'DELETE FROM videos WHERE category NOT IN ({})'.format(
+                    ', '.join('?' * len(categories))),
+                categories)
+            self.commit()
+        return(cursor.rowcount)
+
+    def sync(self):
+        """Commit the pending writes (shelve compatibility)."""
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        """Commit and close the store."""
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
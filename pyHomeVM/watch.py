@@ -0,0 +1,323 @@
+# coding=utf-8
+"""Watch.
+
+Long running mode that only re-reads and processes the event folders
+that change instead of rescanning the whole library. Changes come from
+inotify when pyinotify is installed, otherwise the modification times
+of the event folders are polled.
+"""
+import os
+import time
+import logging
+from CONSTANTS import CONSTANTS
+from library import list_dir, list_event_folders, YEAR_PATTERN
+from core import refresh_structure, get_new_file_ids_from_structure
+from core import check_and_correct_videos_errors, updateStructure
+from core import clean_video_db, mount, umount, syncDirTree, clean_remote
+from core import transferLongVersions
+from caches import save_caches
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+handler = logging.FileHandler(CONSTANTS['log_file_path'])
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+UNKNOWN = object()  # Signature of a folder that was never listed
+WATCH_RETRIES = 3  # Times a folder left out of the structure is retried
+
+
+def folder_mtimes(local):
+    """Function that returns the modification time of every event folder.
+
+    Input: local as local config dict
+    Output: dict with folder paths as keys and mtimes as values
+    """
+    mtimes = {}
+    for folder_path in list_event_folders(local['root_dir']):
+        try:
+            mtimes[folder_path] = os.stat(folder_path).st_mtime
+        except OSError:  # Removed while listing
+            pass
+    return(mtimes)
+
+
+def own_file(folder_path, name):
+    """Function that tells if an entry of an event folder is written by
+    the program itself (chapters, conversions, segments, long versions).
+
+    Input: folder_path as string, name as string, entry of the folder
+    Output: Bool
+    """
+    return(name == CONSTANTS['chapters_file_name'] or
+           name == 'compatibility' or
+           name.startswith('.segments_') or
+           name.endswith('.append.mkv') or
+           name == os.path.basename(os.path.normpath(folder_path)) + '.mkv')
+
+
+def folder_signature(folder_path):
+    """Function that returns the names, sizes and mtimes of a folder's files.
+
+    Used to wait until a folder stopped changing (files still being copied)
+    and to tell the user's changes from the program's own (see own_file)
+    Input: folder_path as string
+    Output: signature as tuple, None if the folder does not exist
+    """
+    try:
+        return(tuple(sorted(
+            (name, file_stat.st_size, file_stat.st_mtime)
+            for name, is_dir, file_stat in list_dir(folder_path)
+            if not is_dir and not own_file(folder_path, name))))
+    except OSError:
+        return(None)
+
+
+class PollingWatcher(object):
+    """Polling watcher.
+
+    Class that reports the event folders whose modification time changed
+    and whose files, the program's own left out, changed too
+    """
+
+    def __init__(self, local):
+        """__init__."""
+        self.local = local
+        self.mtimes = folder_mtimes(local)
+        self.signatures = dict(
+            (folder_path, folder_signature(folder_path)) for folder_path in self.mtimes)
+
+    def changed_folders(self, timeout):
+        """Wait timeout seconds and return the folders that changed."""
+        time.sleep(timeout)
+        mtimes = folder_mtimes(self.local)
+        changed = set()
+        for folder_path in set(mtimes) | set(self.mtimes):
+            if(mtimes.get(folder_path) == self.mtimes.get(folder_path)):
+                continue
+            signature = folder_signature(folder_path)
+            if(signature != self.signatures.get(folder_path)):
+                changed.add(folder_path)
+            self.signatures[folder_path] = signature
+        self.mtimes = mtimes
+        return(changed)
+
+    def reset(self, folder_paths):
+        """Forget the changes made to the processed folders while they
+        were processed, the other folders are still reported."""
+        for folder_path in folder_paths:
+            try:
+                self.mtimes[folder_path] = os.stat(folder_path).st_mtime
+            except OSError:
+                self.mtimes.pop(folder_path, None)
+            self.signatures[folder_path] = folder_signature(folder_path)
+
+
+class InotifyWatcher(object):
+    """Inotify watcher.
+
+    Class that reports the event folders (or year folders) in which
+    inotify saw files being created, written, moved or deleted
+    """
+
+    def __init__(self, local):
+        """__init__."""
+        self.root_dir = local['root_dir']
+        self.changed = set()
+        self.watch_manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.watch_manager, self.process_event)
+        mask = (pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_CLOSE_WRITE)
+        self.watch_manager.add_watch(self.root_dir, mask, rec=True, auto_add=True)
+
+    def process_event(self, event):
+        """Map an inotify event to the folder it happened in, the program's
+        own files are left out (see own_file)."""
+        parts = os.path.relpath(event.pathname, self.root_dir).split(os.sep)
+        if(not YEAR_PATTERN.match(parts[0])):
+            return
+        folder_path = os.path.join(self.root_dir, *parts[0:2])
+        if(len(parts) > 2 and own_file(folder_path, parts[2])):
+            return
+        self.changed.add(folder_path)
+
+    def changed_folders(self, timeout):
+        """Wait up to timeout seconds and return the folders that changed."""
+        if(self.notifier.check_events(timeout * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+        changed = self.changed
+        self.changed = set()
+        return(changed)
+
+    def reset(self, folder_paths):
+        """Discard the events of the processed folders queued while they
+        were processed, the other folders are still reported."""
+        while(self.notifier.check_events(0)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+        processed = set(os.path.normpath(folder_path) for folder_path in folder_paths)
+        self.changed = set(
+            folder_path for folder_path in self.changed
+            if os.path.normpath(folder_path) not in processed and
+            os.path.dirname(os.path.normpath(folder_path)) not in processed)
+
+
+def settled_folders(pending, settle):
+    """Function that returns the pending folders that stopped changing.
+
+    Input:  - pending as dict of folder_path -> (signature, time it was seen)
+            - settle as seconds a folder has to stay unchanged
+    Output: list of folder paths, removed from pending
+    """
+    now = time.time()
+    ready = []
+    for folder_path, (signature, since) in list(pending.items()):
+        current = folder_signature(folder_path)
+        if(current != signature):
+            pending[folder_path] = (current, now)
+        elif(now - since >= settle):
+            ready.append(folder_path)
+            del(pending[folder_path])
+    return(ready)
+
+
+def expand_year_folders(folder_paths, structure, root_dir):
+    """Function that replaces year folders by the event folders they hold.
+
+    Both the event folders on disk and the ones known in the structure
+    are used, so removed and renamed year folders are handled too
+    Input: folder_paths as list of strings, structure as dict, root_dir as string
+    Output: set of event folder paths
+    """
+    expanded = set()
+    root_dir = os.path.normpath(root_dir)
+    for folder_path in folder_paths:
+        if(os.path.dirname(os.path.normpath(folder_path)) != root_dir):  # Event folder
+            expanded.add(folder_path)
+            continue
+        year_prefix = folder_path.decode('utf-8') + u'/'
+        for entry in structure.values():
+            if(entry['path'].startswith(year_prefix)):
+                expanded.add(entry['path'].encode('utf-8'))
+        if(os.path.isdir(folder_path)):
+            expanded.update(
+                os.path.join(folder_path, event)
+                for event, is_dir, _ in list_dir(folder_path)
+                if is_dir)
+    return(expanded)
+
+
+def transfer_long_versions(local, remote, video_db):
+    """Function that sends new long versions to the remote media player."""
+    if(mount(remote)):
+        syncDirTree(local, remote)
+        transferLongVersions(local, remote, video_db)
+        clean_remote(remote)
+        umount(remote)
+    else:
+        logger.info('Mount unssuccesfull, long versions stay local')
+
+
+def process_changes(structure, folder_paths, local, ffmpeg, remote, video_db, caches,
+                    store=None):
+    """Function that processes the event folders that changed.
+
+    Only these folders are listed and hashed, the rest of the structure,
+    the video db and the caches stay in memory.
+    Input:  - structure as dict, the structure currently on disk
+            - folder_paths as list of strings
+            - local, ffmpeg, remote as config dicts
+            - video_db as VideoStore
+            - caches as dict of caches
+            - store as StructureStore recording the changes
+    Output: - new structure as dict, the one recorded in the store if any
+            - folders left out of the store (probe failures) as list
+    """
+    folder_paths = expand_year_folders(folder_paths, structure, local['root_dir'])
+    logger.info('[WATCH] Changes in {}'.format(', '.join(sorted(folder_paths))))
+    new_structure = refresh_structure(structure, folder_paths, local, caches)
+    unicode_paths = set(folder_path.decode('utf-8') for folder_path in folder_paths)
+    changed_structure = dict(
+        (ID, entry) for ID, entry in new_structure.items()
+        if entry['path'] in unicode_paths)
+    video_ids = get_new_file_ids_from_structure(changed_structure, video_db)
+    if(check_and_correct_videos_errors(video_ids, video_db, local, ffmpeg, caches)):
+        new_structure = refresh_structure(structure, folder_paths, local, caches)
+    html_data = updateStructure(
+        structure,
+        new_structure,
+        local,
+        ffmpeg,
+        remote,
+        video_db,
+        caches,
+        store=store)
+    clean_video_db(video_db)
+    video_db.sync()
+    save_caches(caches)
+    if(any(html_data.values())):
+        transfer_long_versions(local, remote, video_db)
+    if(store is None):
+        return(new_structure, [])
+    structure = store.read()
+    kept_paths = set(entry['path'] for entry in structure.values())
+    left_out = sorted(
+        entry['path'].encode('utf-8') for entry in changed_structure.values()
+        if entry['path'] not in kept_paths)
+    return(structure, left_out)
+
+
+def watch_library(structure, local, ffmpeg, remote, video_db, caches, store=None):
+    """Function that processes folders as they change until interrupted.
+
+    Input:  - structure as dict, the structure currently on disk
+            - local, ffmpeg, remote as config dicts
+            - video_db as VideoStore
+            - caches as dict of caches
+            - store as StructureStore recording the changes
+    Output: structure as dict when stopped
+    """
+    if(pyinotify is not None):
+        watcher = InotifyWatcher(local)
+        logger.info('Watching {} with inotify'.format(local['root_dir']))
+    else:
+        watcher = PollingWatcher(local)
+        logger.info('Watching {} by polling every {}s'.format(
+            local['root_dir'], local['watch_interval']))
+    known_paths = set(entry['path'] for entry in structure.values())
+    pending = dict(  # Folders left out by the last run are retried first
+        (folder_path, (UNKNOWN, time.time()))
+        for folder_path in list_event_folders(local['root_dir'])
+        if folder_path.decode('utf-8') not in known_paths)
+    retries = {}  # folder_path -> times it was left out of the structure
+    try:
+        while True:
+            for folder_path in watcher.changed_folders(local['watch_interval']):
+                if(folder_path not in pending):
+                    pending[folder_path] = (UNKNOWN, time.time())
+            ready = settled_folders(pending, local['watch_settle'])
+            if(len(ready) != 0):
+                structure, left_out = process_changes(
+                    structure, ready, local, ffmpeg, remote, video_db, caches,
+                    store)
+                watcher.reset(ready)
+                for folder_path in left_out:
+                    retries[folder_path] = retries.get(folder_path, 0) + 1
+                    if(retries[folder_path] <= WATCH_RETRIES):
+                        logger.info('[WATCH] {} left out, retry {}'.format(
+                            folder_path, retries[folder_path]))
+                        pending[folder_path] = (UNKNOWN, time.time())
+                for folder_path in ready:
+                    if(folder_path not in left_out):
+                        retries.pop(folder_path, None)
+    except KeyboardInterrupt:
+        logger.info('Watch mode stopped')
+    return(structure)